@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -41,11 +43,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'patients.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'patients.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,6 +85,82 @@ DATABASES = {
     }
 }
 
+# Reads of the views with ReplicaReadMixin go to the 'replica' alias when
+# there is one, see patients/databases.py.
+DATABASE_ROUTERS = ['patients.databases.ReplicaRouter']
+
+# PRAGMAs run on every new SQLite connection
+SQLITE_PRAGMAS = {}
+
+# DJAMBU_DB_PROFILE=production: WAL, persistent connections, a longer lock
+# wait and, with DJAMBU_DB_REPLICA=/path/to/copy.sqlite3, a read replica
+# (refresh a local copy with manage.py refresh_replica).
+DJAMBU_DB_PROFILE = os.environ.get('DJAMBU_DB_PROFILE', 'development')
+
+if DJAMBU_DB_PROFILE == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {'timeout': 20},
+    })
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,  # KiB
+        'busy_timeout': 20000,  # ms
+    }
+    if os.environ.get('DJAMBU_DB_REPLICA'):
+        DATABASES['replica'] = dict(DATABASES['default'],
+                                    NAME=os.environ['DJAMBU_DB_REPLICA'],
+                                    TEST={'MIRROR': 'default'})
+elif DJAMBU_DB_PROFILE != 'development':
+    raise ImproperlyConfigured(
+        f'Unknown DJAMBU_DB_PROFILE {DJAMBU_DB_PROFILE!r}.')
+
+
+# Caches
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # rendered exemption certificates, by hash of their content
+    'pdf': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'pdf'),
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    },
+}
+
+PDF_CACHE = 'pdf'
+
+# ExemptionCodes, Place and AnalysisName, see patients/reference.py: with
+# more than one process the cache must be shared by all of them
+REFERENCE_CACHE = 'default'
+if DJAMBU_DB_PROFILE == 'production':
+    CACHES['reference'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'reference'),
+        'TIMEOUT': None,
+    }
+    REFERENCE_CACHE = 'reference'
+
+
+# Request timings, see patients/perf.py
+
+PERF_STATS_WINDOW = 1000
+PERF_STATS_INTERVAL = 60
+PERF_STATS_DIR = os.path.join(BASE_DIR, 'cache', 'perf')
+
+
+# cProfile of the hot paths, see patients/profiling.py
+
+PROFILE_HOOKS = False
+PROFILE_DIR = os.path.join(BASE_DIR, 'cache', 'profiles')
+PROFILE_KEEP = 100
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -119,3 +199,8 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.1/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# Uploaded and generated files (the PDFs rendered in background)
+
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_URL = '/media/'
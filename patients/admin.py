@@ -1,19 +1,32 @@
 from django.contrib import admin
 from django.contrib.admin import AdminSite
+from .forms import ReferenceChoiceField
 from .models import *
+from .reference import reference_table
+
+
+class ReferenceModelAdmin(admin.ModelAdmin):
+    """Reads the foreign keys to the reference tables from their cache."""
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if reference_table(db_field.related_model) is not None:
+            kwargs.setdefault('form_class', ReferenceChoiceField)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
 
 # standard admin site.
 admin.site.register(Patient)
 admin.site.register(ExemptionCodes)
-admin.site.register(Exemption)
+admin.site.register(Exemption, ReferenceModelAdmin)
 admin.site.register(Place)
 admin.site.register(Center)
-admin.site.register(Analysis)
+admin.site.register(Analysis, ReferenceModelAdmin)
 admin.site.register(AnalysisName)
 admin.site.register(BMD)
+admin.site.register(PDFJob)
 
 # admin models
-class AnalysisAdminModel(admin.ModelAdmin):
+class AnalysisAdminModel(ReferenceModelAdmin):
     radio_fields = {'rate': admin.HORIZONTAL}
 
 
@@ -21,7 +34,7 @@ class PatientsAdminModel(admin.ModelAdmin):
     radio_fields = {'sex': admin.HORIZONTAL}
 
 
-class ExemptionAdminModel(admin.ModelAdmin):
+class ExemptionAdminModel(ReferenceModelAdmin):
     radio_fields = {'signature_place': admin.HORIZONTAL}
 
 
@@ -0,0 +1,285 @@
+"""Benchmarks of the hot paths on seeded synthetic data.
+
+generate() fills the database with patients, analyses, exemptions and BMD
+rows drawn from a seeded random generator, so two runs with the same
+seed measure the same data. run() times every scenario and returns a
+JSON-serialisable report; compare() flags the scenarios slower than a
+previous report. manage.py benchmark runs them on a throwaway test
+database.
+"""
+import datetime
+import platform
+import random
+import statistics
+import time
+
+import django
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from patients import models
+from .certificates import exemption_data
+from .search import patient_search_index
+from .views import PDFResponseView
+
+# name, short_name, unit, lower_limit, upper_limit
+ANALYTES = (
+    ('tireotropina', 'TSH', 'mU/L', 0.4, 4.0),
+    ('tiroxina libera', 'FT4', 'ng/dL', 0.7, 1.9),
+    ('triiodotironina libera', 'FT3', 'pg/mL', 2.4, 6.2),
+    ('glicemia', 'glic', 'mg/dL', 70, 100),
+    ('emoglobina glicata', 'HbA1c', 'mmol/mol', 20, 42),
+    ('colesterolo totale', 'col', 'mg/dL', 120, 200),
+    ('colesterolo HDL', 'HDL', 'mg/dL', 40, 90),
+    ('colesterolo LDL', 'LDL', 'mg/dL', 50, 130),
+    ('trigliceridi', 'trigl', 'mg/dL', 40, 150),
+    ('creatinina', 'creat', 'mg/dL', 0.6, 1.2),
+    ('paratormone', 'PTH', 'pg/mL', 15, 65),
+    ('calcio', 'Ca', 'mg/dL', 8.5, 10.5),
+    ('vitamina D', 'vitD', 'ng/mL', 30, 100),
+    ('cortisolo', 'corti', 'ug/dL', 5, 25),
+    ('testosterone', 'testo', 'ng/mL', 2.4, 8.3),
+)
+LAST_NAMES = ('rossi', 'russo', 'ferrari', 'esposito', 'bianchi', 'romano',
+              'colombo', 'ricci', 'marino', 'greco', 'bruno', 'gallo',
+              'conti', 'deluca', 'mancini', 'costa', 'giordano', 'rizzo',
+              'lombardi', 'moretti')
+FIRST_NAMES = ('mario', 'giuseppe', 'luca', 'marco', 'andrea', 'maria',
+               'anna', 'giulia', 'francesca', 'sara', 'paola', 'laura')
+PLACES = ('carvico', 'calusco', 'bergamo', 'milano', 'lecco', 'monza')
+EXEMPTIONS = (('027', 'ipotiroidismo', 'ipot'), ('013', 'diabete', 'diab'),
+              ('031', 'ipertensione', 'iper'), ('025', 'dislipidemia', 'disl'))
+
+
+class Dataset:
+    """The pks of the generated rows, for the scenarios."""
+
+    def __init__(self, patients, exemptions, user):
+        self.patients = patients
+        self.exemptions = exemptions
+        self.user = user
+
+
+def generate(seed: int = 1, patients: int = 200, analyses: int = 50,
+             exemptions: int = 2, bmds: int = 2) -> Dataset:
+    """Fill the database with reproducible synthetic data.
+
+    patients patients, each with analyses analyses spread over the
+    ANALYTES, exemptions exemptions and bmds BMD rows.
+    """
+    rng = random.Random(seed)
+    names = [models.AnalysisName.objects.create(name=name, short_name=short)
+             for name, short, *_ in ANALYTES]
+    codes = [models.ExemptionCodes.objects.create(code=code, name=name,
+                                                  short_name=short)
+             for code, name, short in EXEMPTIONS]
+    places = [models.Place.objects.create(municipality=place)
+              for place in PLACES]
+    models.Patient.objects.bulk_create(
+        models.Patient(
+            last_name=rng.choice(LAST_NAMES),
+            first_name=rng.choice(FIRST_NAMES),
+            sex=rng.choice('fm'), birth_place=rng.choice(PLACES),
+            birth_date=datetime.date(rng.randint(1930, 2000),
+                                     rng.randint(1, 12), rng.randint(1, 28)),
+            fiscal_code=''.join(rng.choice('ABCDEFGHLMNPRSTVZ0123456789')
+                                for _ in range(16)))
+        for _ in range(patients))
+    patient_list = list(models.Patient.objects.order_by('pk'))
+    rows, certificates, densitometries = [], [], []
+    for patient in patient_list:
+        for _ in range(analyses):
+            analyte = rng.randrange(len(ANALYTES))
+            _, _, unit, lower, upper = ANALYTES[analyte]
+            rows.append(models.Analysis(
+                patient=patient, name=names[analyte], unit=unit,
+                date=random_date(rng), lower_limit=lower, upper_limit=upper,
+                value=round(rng.uniform(lower * 0.5, upper * 1.5), 2)))
+        for _ in range(exemptions):
+            certificates.append(models.Exemption(
+                patient=patient, exemption=rng.choice(codes),
+                name=f'{patient.last_name} {patient.first_name}',
+                birth_place=patient.birth_place,
+                birth_date=patient.birth_date,
+                signature_place=rng.choice(places),
+                signature_date=datetime.date(2019, rng.randint(1, 12),
+                                             rng.randint(1, 28))))
+        for _ in range(bmds):
+            densitometries.append(models.BMD(
+                patient=patient, date=random_date(rng),
+                ls_t=round(rng.uniform(-4, 1), 1),
+                fn_t=round(rng.uniform(-4, 1), 1)))
+        if len(rows) > 5000:
+            models.Analysis.objects.bulk_create(rows)
+            rows = []
+    models.Analysis.objects.bulk_create(rows)
+    models.Exemption.objects.bulk_create(certificates)
+    models.BMD.objects.bulk_create(densitometries)
+    if patient_search_index.available():
+        patient_search_index.rebuild()
+    user = get_user_model().objects.create_superuser(
+        'benchmark', 'benchmark@example.com', 'benchmark')
+    return Dataset([p.pk for p in patient_list],
+                   list(models.Exemption.objects.values_list('pk', flat=True)),
+                   user)
+
+
+def random_date(rng) -> str:
+    return f'{rng.randint(1, 28)}/{rng.randint(1, 12)}/' \
+        f'{rng.randint(2010, 2019)}'
+
+
+SCENARIOS = {}
+
+
+def scenario(name: str):
+    """Register the decorated function(bench, n) as a timed scenario."""
+    def decorator(function):
+        SCENARIOS[name] = function
+        return function
+    return decorator
+
+
+class Bench:
+    """State shared by the scenarios of a run."""
+
+    def __init__(self, dataset: Dataset, seed: int = 1):
+        self.dataset = dataset
+        self.rng = random.Random(seed)
+        self.client = Client()
+        self.client.force_login(dataset.user)
+
+    def get(self, url: str, data=None):
+        response = self.client.get(url, data)
+        if response.status_code != 200:
+            raise AssertionError(f'GET {url}: {response.status_code}')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def patient(self) -> int:
+        return self.rng.choice(self.dataset.patients)
+
+
+@scenario('patient_list')
+def patient_list(bench, n):
+    bench.get(reverse('patients:patients_list'))
+
+
+@scenario('patient_list_search')
+def patient_list_search(bench, n):
+    bench.get(reverse('patients:patients_list'),
+              {'q': bench.rng.choice(LAST_NAMES)[:3]})
+
+
+@scenario('patient_detail')
+def patient_detail(bench, n):
+    bench.get(reverse('patients:patient_detail', args=[bench.patient()]))
+
+
+@scenario('ingest')
+def ingest(bench, n):
+    patient = models.Patient(pk=bench.patient())
+    text = f'- {n % 28 + 1}/3/2020 ' + ', '.join(
+        f'{short} {round(bench.rng.uniform(lower, upper), 2)} {unit} '
+        f'({lower}-{upper})' for _, short, unit, lower, upper in ANALYTES)
+    models.Analysis.objects.text_to_analysis(text, patient)
+
+
+@scenario('ratings')
+def ratings(bench, n):
+    models.Analysis.objects.filter(patient=bench.patient()).ratings()
+
+
+@scenario('ratings_all')
+def ratings_all(bench, n):
+    models.Analysis.objects.ratings()
+
+
+@scenario('exemption_pdf')
+def exemption_pdf(bench, n):
+    exemption = models.Exemption.objects.select_related(
+        'exemption', 'signature_place').get(
+        pk=bench.rng.choice(bench.dataset.exemptions))
+    PDFResponseView().make_pdf(exemption_data(exemption))
+
+
+@scenario('admin_patients')
+def admin_patients(bench, n):
+    bench.get(reverse('admin:patients_patient_changelist'))
+
+
+@scenario('admin_analyses')
+def admin_analyses(bench, n):
+    bench.get(reverse('admin:patients_analysis_changelist'))
+
+
+@scenario('admin_exemptions')
+def admin_exemptions(bench, n):
+    bench.get(reverse('patients_admin:patients_exemption_changelist'))
+
+
+def run(bench: Bench, names=None, repeat: int = 20, warmup: int = 2) -> dict:
+    """Time repeat runs of the scenarios (default: all), after warmup."""
+    results = {}
+    for name in names or SCENARIOS:
+        function = SCENARIOS[name]
+        for n in range(warmup):
+            function(bench, n)
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for n in range(repeat):
+                start = time.perf_counter()
+                function(bench, n)
+                timings.append(time.perf_counter() - start)
+        results[name] = summarize(timings)
+        results[name]['queries'] = len(queries) / repeat
+    return results
+
+
+def summarize(timings: list) -> dict:
+    timings = sorted(timings)
+    return {
+        'runs': len(timings),
+        'min': timings[0],
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'max': timings[-1],
+    }
+
+
+def report(results: dict, **meta) -> dict:
+    """The JSON document of a run: results and the environment."""
+    meta.update(python=platform.python_version(),
+                django=django.get_version(),
+                vendor=connection.vendor,
+                date=datetime.datetime.now().isoformat(timespec='seconds'))
+    return {'meta': meta, 'scenarios': results}
+
+
+def compare(old: dict, new: dict, threshold: float = 0.1) -> dict:
+    """Compare the median times of the scenarios of two reports.
+
+    Return {scenario: {'old', 'new', 'ratio', 'status'}} where status is
+    'regression' when new is slower than old by more than threshold,
+    'improvement' when faster by more than threshold, otherwise 'ok'.
+    """
+    comparison = {}
+    for name, result in new['scenarios'].items():
+        if name not in old['scenarios']:
+            continue
+        before, after = old['scenarios'][name]['median'], result['median']
+        ratio = after / before if before else float('inf')
+        if ratio > 1 + threshold:
+            status = 'regression'
+        elif ratio < 1 - threshold:
+            status = 'improvement'
+        else:
+            status = 'ok'
+        comparison[name] = {'old': before, 'new': after, 'ratio': ratio,
+                            'status': status}
+    return comparison
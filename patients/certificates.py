@@ -0,0 +1,133 @@
+"""Exemption certificates as ReportLab stories.
+
+exemption_story() lays out the certificate of one exemption, so a single
+certificate (PDFResponseView) and a batch of them, one per page
+(write_exemptions_pdf), share the same layout. Only the patient and
+exemption lines are built per certificate: the boilerplate is made of
+PDFFragment, parsed once per process.
+"""
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.platypus import PageBreak, SimpleDocTemplate, Spacer, Paragraph
+
+from .tools import PDF_STYLES, PDFFragment, StaticParagraph
+
+TITLE = 'Certificazione esenzione'
+
+label = PDF_STYLES['label']
+center_label = PDF_STYLES['center_label']
+notes = PDF_STYLES['notes']
+
+
+@PDFFragment
+def header() -> list:
+    return [
+        StaticParagraph("Regione Lombardia", center_label),
+        Spacer(1, 3 * cm),
+        StaticParagraph("CERTIFICAZIONE", center_label),
+        StaticParagraph('ai sensi dell’art.4, '
+                        'comma 1 del Decreto Ministero Sanità 28 maggio 1999, '
+                        'n. 329 “Regolamento recante norme di individuazione '
+                        'delle malattie croniche e invalidanti ai sensi dell’'
+                        'articolo 5, comma 1, lettera a) del decreto legislativo'
+                        ' 29 aprile 1998, n. 124”, come modificato dal Decreto '
+                        'Ministero Sanità 21 maggio 2001 n. 296 “Regolamento di '
+                        'aggiornamento del decreto ministeriale 28 maggio 1999, '
+                        'n 329...”', notes),
+        Spacer(1, 1 * cm),
+    ]
+
+
+@PDFFragment
+def pathology_heading() -> list:
+    return [
+        Spacer(1, 0.5 * cm),
+        StaticParagraph("È affetta/o dalla seguente patologia", center_label),
+        StaticParagraph("(descrivere la patologia come riportato nell’elenco di "
+                        "cui all’Allegato 1-II parte del D.M. 329/99 come "
+                        "modificato dal D.M. 296/2001).", notes),
+    ]
+
+
+@PDFFragment
+def code_heading() -> list:
+    return [
+        StaticParagraph("(N.B.: in caso di IPERTENSIONE ARTERIOSA specificare "
+                        "CON DANNO D’ORGANO quando presente, in riferimento alle"
+                        " Linee Guida dell’O.M.S)", notes),
+        Spacer(1, 0.5 * cm),
+        StaticParagraph("Contraddistinta dal Codice", center_label),
+        StaticParagraph("(riportare il Codice di cui all’Allegato 1-II parte del"
+                        " D.M. 329/99 come modificato dal D.M. "
+                        "296/2001)", notes),
+        Spacer(1, 0.2 * cm),
+    ]
+
+
+@PDFFragment
+def code_notes() -> list:
+    return [
+        StaticParagraph("(Cod. progressivo) (Cod. I.C.D.9-C.M.)", notes),
+        Spacer(1, 1.5 * cm),
+    ]
+
+
+@PDFFragment
+def signature() -> list:
+    return [
+        Spacer(1, 1.5 * cm),
+        StaticParagraph("Timbro e firma del Medico", label),
+    ]
+
+
+FRAGMENTS = (header, pathology_heading, code_heading, code_notes, signature)
+
+
+def exemption_data(exemption) -> dict:
+    """The data printed on the certificate of exemption."""
+    return {
+        'name': exemption.name.upper(),
+        'birth_place': exemption.birth_place.capitalize(),
+        'birth_date': exemption.birth_date.strftime("%d/%m/%Y"),
+        'exemption_name': exemption.exemption.name.title(),
+        'exemption_code': exemption.exemption.code,
+        'place': exemption.signature_place.municipality.capitalize(),
+        'date': exemption.signature_date.strftime("%d/%m/%Y"),
+    }
+
+
+def exemption_story(data: dict) -> list:
+    """The flowables of one certificate page, from exemption_data()."""
+    story = header.flowables()
+    story.append(Paragraph(
+        f"Si certifica che la/il Sig.ra/re <i>{data['name']}</i>", label))
+    story.append(Paragraph(f"nata/o a <i>{data['birth_place']}</i>", label))
+    story.append(Paragraph(f"in data <i>{data['birth_date']}</i>", label))
+    story += pathology_heading.flowables()
+    story.append(Paragraph(f"<i>{data['exemption_name']}</i>",
+                           PDF_STYLES['exemption']))
+    story += code_heading.flowables()
+    story.append(Paragraph(f"{data['exemption_code']}", PDF_STYLES['code']))
+    story += code_notes.flowables()
+    story.append(Paragraph(f"{data['place']}, {data['date']}", label))
+    story += signature.flowables()
+    return story
+
+
+def write_exemptions_pdf(exemptions, file) -> int:
+    """Write the certificates of exemptions to file, one per page.
+
+    exemptions must select_related exemption and signature_place; they are
+    read with iterator() and laid out in a single document. Return the
+    number of certificates (no PDF is written when it is 0).
+    """
+    story = []
+    printed = 0
+    for exemption in exemptions.iterator():
+        if printed:
+            story.append(PageBreak())
+        story.extend(exemption_story(exemption_data(exemption)))
+        printed += 1
+    if printed:
+        SimpleDocTemplate(file, pagesize=A4, title=TITLE).build(story)
+    return printed
@@ -0,0 +1,81 @@
+"""SQLite tuning and the read replica.
+
+apply_sqlite_pragmas() runs settings.SQLITE_PRAGMAS on every new SQLite
+connection (connected to connection_created in signals.py).
+
+ReplicaRouter sends the reads made inside use_replica() to the 'replica'
+alias, when DATABASES has one; every other query, and every write, goes
+to 'default'. ReplicaReadMixin wraps the GET requests of read-only views
+in use_replica(), template rendering included. The replica lags behind
+'default' until the next manage.py refresh_replica: don't use it for
+pages shown right after a write, like the patient detail (where
+RapidAddExemptionView redirects) and the certificates of the exemptions
+just added.
+"""
+import re
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+REPLICA = 'replica'
+_PRAGMA_RE = re.compile(r'^\w+$')
+
+_state = threading.local()
+
+
+def apply_sqlite_pragmas(connection) -> None:
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            if not _PRAGMA_RE.match(name) or \
+                    not _PRAGMA_RE.match(str(value).lstrip('-')):
+                raise ValueError(f'Invalid SQLite pragma {name}={value}.')
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@contextmanager
+def use_replica(alias: str = REPLICA):
+    """Read from alias, if configured, inside the block (this thread)."""
+    previous = getattr(_state, 'alias', None)
+    _state.alias = alias
+    try:
+        yield
+    finally:
+        _state.alias = previous
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        alias = getattr(_state, 'alias', None)
+        if alias is not None and alias in connections.databases:
+            return alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as default
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica is a copy of default, never migrated by itself
+        return False if db == REPLICA else None
+
+
+class ReplicaReadMixin:
+    """Serve the GET and HEAD requests of a view from the replica."""
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        with use_replica():
+            response = super().dispatch(request, *args, **kwargs)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        return response
@@ -1,15 +1,113 @@
 from django import forms
-from .models import Exemption
+from django.core.exceptions import ValidationError
+
+from .models import Exemption, Place
+from .reference import reference_table
+
+
+class ReferenceChoiceIterator:
+    """Choices of a ReferenceChoiceField, read from its reference table."""
+
+    def __init__(self, field):
+        self.field = field
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield '', self.field.empty_label
+        for obj in self.field.reference.all():
+            yield self.field.prepare_value(obj), \
+                self.field.label_from_instance(obj)
+
+    def __len__(self):
+        return len(self.field.reference.all()) + \
+            (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or \
+            bool(self.field.reference.all())
+
+
+class ReferenceChoiceField(forms.ModelChoiceField):
+    """ModelChoiceField over a cached reference table (see reference.py).
+
+    Rendering and validating it costs no query. The queryset only names the
+    model: every row of the table is a choice, whatever its filters.
+    """
+
+    def __init__(self, queryset, **kwargs):
+        self.reference = reference_table(queryset.model)
+        super().__init__(queryset, **kwargs)
+
+    def _get_choices(self):
+        return ReferenceChoiceIterator(self)
+
+    choices = property(_get_choices, forms.ChoiceField._set_choices)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if isinstance(value, self.queryset.model):
+            value = value.pk
+        try:
+            obj = self.reference.get(
+                self.queryset.model._meta.pk.to_python(value))
+        except (ValidationError, TypeError):
+            obj = None
+        if obj is None:
+            raise ValidationError(self.error_messages['invalid_choice'],
+                                  code='invalid_choice')
+        return obj
 
 
 class RapidExemptionForm(forms.ModelForm):
-    """Used in exemption panel to rapidly add an exemption of that patient."""
+    """Used in exemption panel to rapidly add an exemption of that patient.
+
+    Given a patient, the form is bound to it with a hidden field and never
+    loads the other patients.
+    """
     class Meta:
         model = Exemption
         fields = ['patient', 'exemption', 'signature_place', 'signature_date']
+        field_classes = {'exemption': ReferenceChoiceField,
+                         'signature_place': ReferenceChoiceField}
+
+    def __init__(self, *args, patient=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if patient is not None:
+            field = self.fields['patient']
+            field.queryset = field.queryset.filter(pk=patient.pk)
+            field.widget = forms.HiddenInput()
+            self.initial['patient'] = patient.pk
 
 
 class TextToAnalysisForm(forms.Form):
     """Used to quickly translate a string in Analysis objects."""
     text = forms.CharField()
     patient = forms.CharField()
+
+
+class ExemptionBatchForm(forms.Form):
+    """Filter of the exemptions printed together in one PDF.
+
+    Every field is optional: signature date range, place and exemption code.
+    """
+    date_from = forms.DateField(required=False)
+    date_to = forms.DateField(required=False)
+    place = ReferenceChoiceField(queryset=Place.objects.all(),
+                                 required=False)
+    code = forms.CharField(max_length=10, required=False)
+
+    def exemptions(self):
+        """The exemptions matching the cleaned filter, in signature order."""
+        queryset = Exemption.objects.select_related('exemption',
+                                                    'signature_place')
+        data = self.cleaned_data
+        if data['date_from']:
+            queryset = queryset.filter(signature_date__gte=data['date_from'])
+        if data['date_to']:
+            queryset = queryset.filter(signature_date__lte=data['date_to'])
+        if data['place']:
+            queryset = queryset.filter(signature_place=data['place'])
+        if data['code']:
+            queryset = queryset.filter(exemption__code=data['code'])
+        return queryset.order_by('signature_date', 'pk')
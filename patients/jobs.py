@@ -0,0 +1,128 @@
+"""Background rendering of the large PDF documents.
+
+A request enqueues a PDFJob, i.e. a row of the database (no broker): its
+kind names a renderer registered on pdf_job_queue and its params are the
+form data of that renderer. manage.py run_pdf_workers claims the queued
+jobs and renders them with a pool of threads; the client polls the status
+of the job and downloads the file when it is done.
+"""
+import datetime
+import json
+import tempfile
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import close_old_connections
+from django.utils import timezone
+
+from patients import models
+from .certificates import write_exemptions_pdf
+from .forms import ExemptionBatchForm
+
+
+class PDFJobQueue:
+
+    def __init__(self):
+        self.renderers = {}
+
+    def register(self, kind: str, form_class):
+        """Decorator registering render(form, file) -> pages as kind.
+
+        form_class validates the params of the jobs, both when they are
+        enqueued and when they are rendered.
+        """
+        def decorator(render):
+            self.renderers[kind] = (form_class, render)
+            return render
+        return decorator
+
+    def enqueue(self, kind: str, params: dict):
+        """Save and return a queued PDFJob.
+
+        Raise KeyError for an unknown kind and ValidationError for invalid
+        params.
+        """
+        form = self.get_form(kind, params)
+        if not form.is_valid():
+            raise ValidationError(form.errors)
+        return models.PDFJob.objects.create(kind=kind,
+                                            params=json.dumps(params))
+
+    def get_form(self, kind: str, params: dict):
+        form_class, _ = self.renderers[kind]
+        return form_class(params)
+
+    def claim(self):
+        """Mark the oldest queued job as running and return it (or None).
+
+        The conditional UPDATE lets many workers, in any process, poll
+        the same table: only one of them gets each job.
+        """
+        jobs = models.PDFJob.objects.filter(status=models.PDFJob.QUEUED)
+        for pk in jobs.order_by('created').values_list('pk', flat=True)[:10]:
+            claimed = jobs.filter(pk=pk).update(status=models.PDFJob.RUNNING,
+                                                started=timezone.now())
+            if claimed:
+                return models.PDFJob.objects.get(pk=pk)
+        return None
+
+    def run(self, job) -> None:
+        """Render job into its file and save its outcome."""
+        try:
+            form = self.get_form(job.kind, json.loads(job.params))
+            if not form.is_valid():
+                raise ValueError(form.errors.as_text())
+            _, render = self.renderers[job.kind]
+            with tempfile.TemporaryFile() as file:
+                pages = render(form, file)
+                if not pages:
+                    raise ValueError('No document matches the filter.')
+                file.seek(0)
+                job.file.save(f'{job.pk}.pdf', File(file), save=False)
+        except Exception as error:
+            job.status = models.PDFJob.FAILED
+            job.error = f'{type(error).__name__}: {error}'
+        else:
+            job.status = models.PDFJob.DONE
+            job.pages = pages
+        job.finished = timezone.now()
+        job.save(update_fields=['status', 'file', 'pages', 'error',
+                                'finished'])
+
+    def work(self, stop=None, poll: float = 2, drain: bool = False) -> int:
+        """Run the queued jobs until stop (a threading.Event) is set.
+
+        With drain return as soon as the queue is empty. Return the number
+        of jobs run.
+        """
+        done = 0
+        while stop is None or not stop.is_set():
+            close_old_connections()
+            job = self.claim()
+            if job is not None:
+                self.run(job)
+                done += 1
+            elif drain:
+                break
+            elif stop is not None:
+                stop.wait(poll)
+            else:
+                time.sleep(poll)
+        return done
+
+    def requeue_stale(self, minutes: float) -> int:
+        """Queue again the jobs running for more than minutes, e.g. those
+        of a killed worker; return their number."""
+        started = timezone.now() - datetime.timedelta(minutes=minutes)
+        return models.PDFJob.objects.filter(
+            status=models.PDFJob.RUNNING, started__lt=started,
+        ).update(status=models.PDFJob.QUEUED, started=None)
+
+
+pdf_job_queue = PDFJobQueue()
+
+
+@pdf_job_queue.register('exemptions', ExemptionBatchForm)
+def render_exemptions(form, file) -> int:
+    return write_exemptions_pdf(form.exemptions(), file)
@@ -0,0 +1,82 @@
+import io
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate
+
+from patients import certificates
+from patients.tools import StaticParagraph, make_pdf_styles
+from patients.views import PDFResponseView
+
+SAMPLE = {
+    'name': 'ROSSI MARIO',
+    'birth_place': 'Carvico',
+    'birth_date': '01/01/1950',
+    'exemption_name': 'Ipotiroidismo Congenito, Ipotiroidismo Acquisito',
+    'exemption_code': '027',
+    'place': 'Carvico',
+    'date': '01/03/2019',
+}
+
+
+class Command(BaseCommand):
+    help = "Measure the exemption certificates rendered per second."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=200,
+                            help='certificates rendered per scenario')
+
+    def handle(self, count, **options):
+        if count < 1:
+            raise CommandError('--count must be positive.')
+        view = PDFResponseView()
+        scenarios = [
+            ('legacy (fresh styles, every paragraph parsed and broken)',
+             self.render_legacy),
+            ('cold (boilerplate parsed per certificate)',
+             lambda data: self.render_cold(view, data)),
+            ('warm (precompiled boilerplate)', view.make_pdf),
+        ]
+        for name, render in scenarios:
+            self.report(name, count, self.time(render, count))
+        self.report('batch (one document, one page each)', count,
+                    self.time_batch(count))
+
+    def time(self, render, count: int) -> float:
+        render(SAMPLE)  # warm up fonts and imports
+        start = time.perf_counter()
+        for n in range(count):
+            render(dict(SAMPLE, name=f'ROSSI MARIO {n}'))
+        return time.perf_counter() - start
+
+    def time_batch(self, count: int) -> float:
+        start = time.perf_counter()
+        story = []
+        for n in range(count):
+            if story:
+                story.append(PageBreak())
+            story += certificates.exemption_story(
+                dict(SAMPLE, name=f'ROSSI MARIO {n}'))
+        SimpleDocTemplate(io.BytesIO(), pagesize=A4).build(story)
+        return time.perf_counter() - start
+
+    def render_legacy(self, data: dict) -> bytes:
+        """make_pdf before the fragments: six new ParagraphStyles and plain
+        Paragraphs, parsed and broken, for every certificate."""
+        styles = make_pdf_styles()
+        story = [Paragraph(flowable.text, styles[flowable.style.name])
+                 if isinstance(flowable, StaticParagraph) else flowable
+                 for flowable in certificates.exemption_story(data)]
+        file = io.BytesIO()
+        SimpleDocTemplate(file, pagesize=A4).build(story)
+        return file.getvalue()
+
+    def render_cold(self, view, data: dict) -> bytes:
+        for fragment in certificates.FRAGMENTS:
+            fragment.clear()
+        return view.make_pdf(data)
+
+    def report(self, name: str, count: int, elapsed: float) -> None:
+        self.stdout.write(f"{name}: {count} in {elapsed:.2f}s "
+                          f"({count / elapsed:.0f} certificates/s)")
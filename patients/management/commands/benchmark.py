@@ -0,0 +1,87 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, \
+    teardown_test_environment
+
+from patients import bench
+
+
+class Command(BaseCommand):
+    help = "Time the hot paths on seeded synthetic data in a test database " \
+           "and write a JSON report, or compare two reports."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--patients', type=int, default=200)
+        parser.add_argument('--analyses', type=int, default=50,
+                            help='analyses per patient')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='timed runs per scenario')
+        parser.add_argument('--scenario', action='append',
+                            choices=sorted(bench.SCENARIOS),
+                            help='scenario to run, repeatable (default: all)')
+        parser.add_argument('--output', help='JSON report file (default: '
+                                             'standard output)')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='reuse the test database')
+        parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                            help='compare two reports instead, failing on '
+                                 'regressions')
+        parser.add_argument('--threshold', type=float, default=0.1,
+                            help='relative slowdown of the median counted as '
+                                 'a regression (default 0.1)')
+
+    def handle(self, **options):
+        if options['compare']:
+            self.compare(*options['compare'], options['threshold'])
+            return
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be positive.')
+        report = self.run(options)
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(text + '\n')
+        else:
+            self.stdout.write(text)
+
+    def run(self, options) -> dict:
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            self.stderr.write('generating data...')
+            dataset = bench.generate(seed=options['seed'],
+                                     patients=options['patients'],
+                                     analyses=options['analyses'])
+            results = {}
+            for name in options['scenario'] or bench.SCENARIOS:
+                self.stderr.write(f'{name}...')
+                results.update(bench.run(bench.Bench(dataset, options['seed']),
+                                         [name], options['repeat']))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0,
+                                                keepdb=options['keepdb'])
+            teardown_test_environment()
+        return bench.report(results, seed=options['seed'],
+                            patients=options['patients'],
+                            analyses=options['analyses'],
+                            repeat=options['repeat'])
+
+    def compare(self, old_path: str, new_path: str, threshold: float):
+        try:
+            with open(old_path) as old, open(new_path) as new:
+                comparison = bench.compare(json.load(old), json.load(new),
+                                           threshold)
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+        for name, row in comparison.items():
+            self.stdout.write(f"{name:24} {row['old'] * 1000:9.2f}ms "
+                              f"{row['new'] * 1000:9.2f}ms "
+                              f"{row['ratio']:6.2f}x  {row['status']}")
+        regressions = [name for name, row in comparison.items()
+                       if row['status'] == 'regression']
+        if regressions:
+            raise CommandError(f"regressions: {', '.join(regressions)}")
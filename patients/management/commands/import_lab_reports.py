@@ -0,0 +1,142 @@
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from patients.models import Analysis, Patient
+from patients.profiling import profile_hook
+from patients.tools import ItalianPeriodDate, TextToAnalysisTranslator
+
+translator = TextToAnalysisTranslator()
+
+
+@profile_hook('import_lab_reports.parse_chunk')
+def parse_chunk(chunk: list) -> list:
+    """Parse (line_number, line) pairs of 'FISCALCODE - dd/mm/yyyy ...'.
+
+    Run in the worker processes: return (line_number, fiscal_code, date,
+    analyses_data) for good lines and (line_number, None, error, None) for
+    the rejected ones. Any error of the parser rejects its line only: an
+    exception out of a worker would abort the whole import.
+    """
+    parsed = []
+    for line_number, line in chunk:
+        try:
+            fiscal_code, report = line.split(maxsplit=1)
+            date, analyses_data = translator.parse(report)
+            date = ItalianPeriodDate.fromstring(date)
+        except Exception as error:
+            parsed.append((line_number, None,
+                           f'{type(error).__name__}: {error}', None))
+        else:
+            parsed.append((line_number, fiscal_code.upper(), date,
+                           analyses_data))
+    return parsed
+
+
+class Command(BaseCommand):
+    help = "Import a text file of lab reports, one " \
+           "'FISCALCODE - dd/mm/yyyy analyte value, ...' per line."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='lines saved per transaction')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='parser processes, 0 to parse in process '
+                                 '(default: one per CPU)')
+        parser.add_argument('--start-method', default=None,
+                            choices=multiprocessing.get_all_start_methods(),
+                            help='how the parser processes are started '
+                                 '(default: the platform one)')
+        parser.add_argument('--encoding', default='utf-8')
+
+    def handle(self, path, chunk_size, workers, start_method, encoding,
+               **options):
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be positive.')
+        self.verbosity = options['verbosity']
+        self.lines = self.rejected = self.created = self.skipped = 0
+        start = time.perf_counter()
+        try:
+            with open(path, encoding=encoding) as lines:
+                chunks = self.read_chunks(lines, chunk_size)
+                for parsed in self.parse_chunks(chunks, workers,
+                                                start_method):
+                    self.save_chunk(parsed)
+        except OSError as error:
+            raise CommandError(error)
+        elapsed = time.perf_counter() - start
+        rate = self.lines / elapsed if elapsed else 0
+        self.stdout.write(
+            f"{self.lines} lines in {elapsed:.2f}s ({rate:.0f} lines/s): "
+            f"{self.created} analyses created, {self.rejected} rejected "
+            f"lines, {self.skipped} skipped analytes.")
+
+    def read_chunks(self, lines, chunk_size: int):
+        """Stream the file as lists of (line_number, line)."""
+        numbered = ((n, line) for n, line in enumerate(lines, start=1)
+                    if line.strip())
+        while True:
+            chunk = list(islice(numbered, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def parse_chunks(self, chunks, workers, start_method=None):
+        """Yield parse_chunk() of every chunk, in order.
+
+        With a process pool at most two chunks per worker are in flight, so
+        the file is never read ahead into memory. The workers run
+        django.setup(): with the spawn start method (macOS, Windows) they
+        import this module, and with it the models, from scratch.
+        """
+        if workers == 0:
+            yield from map(parse_chunk, chunks)
+            return
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(
+                max_workers=workers, initializer=django.setup,
+                mp_context=multiprocessing.get_context(start_method),
+        ) as executor:
+            in_flight = deque()
+            for chunk in chunks:
+                in_flight.append(executor.submit(parse_chunk, chunk))
+                if len(in_flight) >= 2 * workers:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+
+    @profile_hook('import_lab_reports.save_chunk')
+    def save_chunk(self, parsed: list) -> None:
+        codes = {code for _, code, _, _ in parsed if code is not None}
+        patients = {p.fiscal_code: p for p in
+                    Patient.objects.filter(fiscal_code__in=codes)}
+        analyses = []
+        diagnostics = []
+        snapshot = Analysis.objects.names_index.snapshot()
+        for line_number, code, date, analyses_data in parsed:
+            self.lines += 1
+            if code is None:
+                self.reject(line_number, date)
+            elif code not in patients:
+                self.reject(line_number, f"unknown patient {code}")
+            else:
+                Analysis.objects.build_analyses(date, analyses_data,
+                                                patients[code], analyses,
+                                                diagnostics, snapshot)
+        with transaction.atomic():
+            Analysis.objects.bulk_create(analyses)
+        self.created += len(analyses)
+        self.skipped += len(diagnostics) - len(analyses)
+
+    def reject(self, line_number: int, reason: str) -> None:
+        self.rejected += 1
+        if self.verbosity > 1:
+            self.stderr.write(f"line {line_number}: {reason}")
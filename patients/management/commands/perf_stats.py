@@ -0,0 +1,54 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from patients.perf import METRICS, load_snapshots, summarize
+
+
+class Command(BaseCommand):
+    help = "Show the request timing percentiles per URL name, merged from " \
+           "the snapshots written by the web processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None,
+                            help='snapshot directory (default: '
+                                 'PERF_STATS_DIR)')
+        parser.add_argument('--max-age', type=float, default=None,
+                            help='ignore snapshots older than these seconds')
+        parser.add_argument('--json', action='store_true')
+        parser.add_argument('--clear', action='store_true',
+                            help='delete the snapshots afterwards')
+
+    def handle(self, **options):
+        directory = options['dir'] or getattr(settings, 'PERF_STATS_DIR',
+                                              None)
+        if not directory:
+            raise CommandError('No snapshot directory: set PERF_STATS_DIR.')
+        processes, samples = load_snapshots(directory, options['max_age'])
+        summary = summarize(samples)
+        if options['json']:
+            self.stdout.write(json.dumps({'processes': processes,
+                                          'url_names': summary}, indent=2))
+        else:
+            self.write_table(processes, summary)
+        if options['clear'] and os.path.isdir(directory):
+            for file_name in os.listdir(directory):
+                if file_name.endswith('.json'):
+                    os.remove(os.path.join(directory, file_name))
+
+    def write_table(self, processes: int, summary: dict) -> None:
+        self.stdout.write(f"{processes} processes")
+        self.stdout.write(f"{'url name':36} {'count':>6} " + ' '.join(
+            f"{metric + ' p50/p90/p99':>24}" for metric in METRICS))
+        for name, stats in sorted(summary.items(),
+                                  key=lambda item: -item[1]['count']):
+            cells = []
+            for metric in METRICS:
+                scale = 1 if metric == 'queries' else 1000
+                cells.append('{:>24}'.format('/'.join(
+                    f"{stats[metric][p] * scale:.0f}"
+                    for p in ('p50', 'p90', 'p99'))))
+            self.stdout.write(f"{name:36} {stats['count']:>6} " +
+                              ' '.join(cells))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from patients.certificates import write_exemptions_pdf
+from patients.forms import ExemptionBatchForm
+
+
+class Command(BaseCommand):
+    help = "Print the certificates of the matching exemptions into one PDF, " \
+           "one per page."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='the PDF to write')
+        parser.add_argument('--from', dest='date_from',
+                            help='first signature date, yyyy-mm-dd')
+        parser.add_argument('--to', dest='date_to',
+                            help='last signature date, yyyy-mm-dd')
+        parser.add_argument('--place', help='pk of the signature place')
+        parser.add_argument('--code', help='exemption code, e.g. 035')
+
+    def handle(self, path, **options):
+        form = ExemptionBatchForm({name: options[name] for name in
+                                   ('date_from', 'date_to', 'place', 'code')
+                                   if options[name] is not None})
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+        exemptions = form.exemptions()
+        if not exemptions.exists():
+            raise CommandError('No exemption matches the filter.')
+        try:
+            with open(path, 'wb') as file:
+                printed = write_exemptions_pdf(exemptions, file)
+        except OSError as error:
+            raise CommandError(error)
+        self.stdout.write(f"{printed} certificates printed to {path}.")
@@ -0,0 +1,89 @@
+import datetime
+import io
+import os
+import pstats
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from patients.profiling import load_meta, profile_ids
+
+
+class Command(BaseCommand):
+    help = "List the saved profiles of the hot paths, or summarize their " \
+           "top functions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*',
+                            help='profiles to summarize (default: all the '
+                                 'selected ones)')
+        parser.add_argument('--dir', default=None,
+                            help='profile directory (default: PROFILE_DIR)')
+        parser.add_argument('--name', default='',
+                            help='only the profiles whose name contains it')
+        parser.add_argument('--last', type=int, default=None,
+                            help='only the last N profiles')
+        parser.add_argument('--top', type=int, default=None,
+                            help='summarize the top N functions of the '
+                                 'selected profiles')
+        parser.add_argument('--sort', default='cumulative',
+                            help='pstats sort key (default: cumulative)')
+        parser.add_argument('--clear', action='store_true',
+                            help='delete the selected profiles')
+
+    def handle(self, ids, **options):
+        directory = options['dir'] or getattr(settings, 'PROFILE_DIR', None)
+        if not directory:
+            raise CommandError('No profile directory: set PROFILE_DIR.')
+        selected = [load_meta(directory, profile_id)
+                    for profile_id in ids or profile_ids(directory)]
+        selected = [meta for meta in selected
+                    if options['name'] in meta['name']]
+        if options['last']:
+            selected = selected[-options['last']:]
+        if not selected:
+            self.stdout.write('No profiles.')
+            return
+        paths = [os.path.join(directory, meta['id'] + '.prof')
+                 for meta in selected]
+        if options['clear']:
+            for path in paths:
+                for file_path in (path, path[:-5] + '.json'):
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+            self.stdout.write(f"{len(paths)} profiles deleted.")
+        elif options['top']:
+            report = io.StringIO()
+            try:
+                stats = pstats.Stats(*paths, stream=report)
+            except (OSError, TypeError) as error:
+                raise CommandError(error)
+            self.stdout.write(f"{len(paths)} profiles")
+            self.write_counters(selected)
+            stats.strip_dirs().sort_stats(options['sort']) \
+                .print_stats(options['top'])
+            self.stdout.write(report.getvalue())
+        else:
+            for meta in selected:
+                self.write_meta(meta)
+
+    def write_meta(self, meta: dict) -> None:
+        when = datetime.datetime.fromtimestamp(meta['time']) \
+            .isoformat(sep=' ', timespec='seconds') if meta['time'] else '?'
+        duration = f"{meta['duration'] * 1000:9.1f}ms" \
+            if meta['duration'] is not None else '?'
+        counters = ', '.join(f"{name} {calls}x {elapsed * 1000:.1f}ms"
+                             for name, (calls, elapsed)
+                             in meta['counters'].items())
+        self.stdout.write(f"{meta['id']}  {when}  {duration}  {meta['name']}"
+                          + (f"  [{counters}]" if counters else ''))
+
+    def write_counters(self, selected: list) -> None:
+        totals = {}
+        for meta in selected:
+            for name, (calls, elapsed) in meta['counters'].items():
+                total_calls, total_elapsed = totals.get(name, (0, 0.0))
+                totals[name] = (total_calls + calls, total_elapsed + elapsed)
+        for name, (calls, elapsed) in totals.items():
+            self.stdout.write(f"{name}: {calls} calls, "
+                              f"{elapsed * 1000:.1f}ms")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from patients.search import patient_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text patient search table from the patients."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, chunk_size, **options):
+        if not patient_search_index.available():
+            raise CommandError('The patient search table needs SQLite FTS5.')
+        indexed = patient_search_index.rebuild(chunk_size=chunk_size)
+        self.stdout.write(f"{indexed} patients indexed.")
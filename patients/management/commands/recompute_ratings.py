@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Min
+
+from patients.managers import rating_expression
+from patients.models import Analysis
+
+
+class Command(BaseCommand):
+    help = "Store the rating of every analysis in computed_rating. Run it " \
+           "again when Analysis._tolerance changes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='analyses updated per transaction')
+
+    def handle(self, chunk_size, **options):
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be positive.')
+        bounds = Analysis.objects.aggregate(first=Min('pk'), last=Max('pk'))
+        if bounds['first'] is None:
+            self.stdout.write('No analyses.')
+            return
+        rating = rating_expression(Analysis._tolerance)
+        updated = 0
+        for start in range(bounds['first'], bounds['last'] + 1, chunk_size):
+            with transaction.atomic():
+                updated += Analysis.objects.filter(
+                    pk__gte=start, pk__lt=start + chunk_size,
+                ).update(computed_rating=rating)
+        self.stdout.write(f"{updated} analyses rated.")
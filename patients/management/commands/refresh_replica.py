@@ -0,0 +1,29 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from patients.databases import REPLICA
+
+
+class Command(BaseCommand):
+    help = "Copy the default SQLite database into the replica with the " \
+           "SQLite backup API; open replica connections see the new data."
+
+    def handle(self, **options):
+        if REPLICA not in connections.databases:
+            raise CommandError('No replica database: set DJAMBU_DB_REPLICA '
+                               'with DJAMBU_DB_PROFILE=production.')
+        source = connections['default']
+        if source.vendor != 'sqlite':
+            raise CommandError('refresh_replica copies SQLite databases; '
+                               'replicate other databases with their tools.')
+        source.ensure_connection()
+        target = sqlite3.connect(connections.databases[REPLICA]['NAME'])
+        try:
+            source.connection.backup(target)
+        except sqlite3.Error as error:
+            raise CommandError(error)
+        finally:
+            target.close()
+        self.stdout.write('Replica refreshed.')
@@ -0,0 +1,52 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from patients.jobs import pdf_job_queue
+
+
+class Command(BaseCommand):
+    help = "Render the queued PDF jobs with a pool of worker threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2,
+                            help='worker threads, 0 to render in process')
+        parser.add_argument('--poll', type=float, default=2,
+                            help='seconds between polls of an empty queue')
+        parser.add_argument('--drain', action='store_true',
+                            help='exit when the queue is empty')
+        parser.add_argument('--requeue-after', type=float, default=60,
+                            help='minutes after which a running job is '
+                                 'considered lost and queued again')
+
+    def handle(self, workers, poll, drain, requeue_after, **options):
+        if workers < 0:
+            raise CommandError('--workers cannot be negative.')
+        requeued = pdf_job_queue.requeue_stale(requeue_after)
+        if requeued:
+            self.stderr.write(f"{requeued} stale jobs queued again.")
+        if workers == 0:
+            done = pdf_job_queue.work(poll=poll, drain=drain)
+        else:
+            done = self.run_pool(workers, poll, drain)
+        self.stdout.write(f"{done} jobs rendered.")
+
+    def run_pool(self, workers: int, poll: float, drain: bool) -> int:
+        stop = threading.Event()
+
+        def work():
+            try:
+                return pdf_job_queue.work(stop=stop, poll=poll, drain=drain)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(work) for _ in range(workers)]
+            try:
+                return sum(future.result() for future in futures)
+            except KeyboardInterrupt:
+                # let the running jobs finish
+                stop.set()
+                return sum(future.result() for future in futures)
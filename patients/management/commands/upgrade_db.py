@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from patients.upgrade import convert_period_dates, upgrade
+
+
+class Command(BaseCommand):
+    help = "Add the tables, columns and indexes of the patients models " \
+           "missing in an existing database and store its period dates " \
+           "as keys. Run it after migrate."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--revert-period-dates', action='store_true',
+                            help="only store the period dates back in the "
+                                 "'d/m/yyyy' format, for the older code")
+
+    def handle(self, database, revert_period_dates, **options):
+        if revert_period_dates:
+            converted, _ = convert_period_dates(database, backwards=True)
+            self.stdout.write(f"{converted} period dates reverted.")
+            return
+        done = upgrade(database)
+        for step in done:
+            self.stdout.write(step)
+        self.stdout.write(f"{len(done)} upgrade steps." if done else
+                          "Database up to date.")
@@ -1,18 +1,210 @@
-from django.db.models import Manager
+from threading import Lock
+
+from django.db import transaction
+from django.db.models import Case, CharField, F, Manager, Q, QuerySet, \
+    Value, When
 from patients import models
-from .tools import TextToAnalysisTranslator
+from .profiling import profile_hook
+from .ratings import rate_arrays, rate_queryset
+from .reference import analysis_names
+from .tools import PrefixIndex, TextToAnalysisTranslator
+
+FOUND = 'found'
+UNKNOWN = 'unknown'
+AMBIGUOUS = 'ambiguous'
+
+
+class AnalysisNameIndex:
+    """Process-local prefix index over AnalysisName name and short_name.
+
+    Built from the cached analysis_names reference table (see reference.py)
+    and rebuilt when its version changes, so resolving a token costs no SQL.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._index = None
+
+    def invalidate(self):
+        analysis_names.invalidate()
+
+    def resolve(self, token: str, snapshot: tuple = None) -> tuple:
+        """Return (status, AnalysisName or None, candidates) for token.
+
+        An exact (case insensitive) name or short_name match wins, otherwise
+        token must be the prefix of exactly one AnalysisName. When more than
+        one matches the status is AMBIGUOUS and candidates lists them.
+        Without a snapshot() the version of the table is checked, which
+        costs a cache get: pass one when resolving a batch of tokens.
+        """
+        prefixes, names = snapshot or self.snapshot()
+        token = token.lower()
+        pks = prefixes.exact(token) or prefixes.search(token)
+        candidates = sorted((names[pk] for pk in pks), key=lambda n: n.pk)
+        if not candidates:
+            return UNKNOWN, None, candidates
+        if len(candidates) > 1:
+            return AMBIGUOUS, None, candidates
+        return FOUND, candidates[0], candidates
+
+    def snapshot(self) -> tuple:
+        """The index of the current version of the table."""
+        version, names = analysis_names.load()
+        index = self._index
+        if index is None or index[0] != version:
+            with self._lock:
+                if self._index is None or self._index[0] != version:
+                    self._index = (version, self._build(names), names)
+                index = self._index
+        return index[1:]
+
+    def _build(self, names: dict) -> PrefixIndex:
+        pairs = []
+        for name in names.values():
+            pairs.append((name.name.lower(), name.pk))
+            pairs.append((name.short_name.lower(), name.pk))
+        return PrefixIndex(pairs)
+
+
+analysis_names_index = AnalysisNameIndex()
+
+
+def rating_expression(tolerance: float) -> Case:
+    """SQL expression of Analysis.rating(), for annotations and updates."""
+    value, lower, upper = F('value'), F('lower_limit'), F('upper_limit')
+    delta = (upper - lower) * tolerance
+    unrated = Q(lower_limit=None) | Q(lower_limit=0) | \
+        Q(upper_limit=None) | Q(upper_limit=0) | Q(value=None)
+    return Case(
+        When(~Q(rate=None) & ~Q(rate=''), then=F('rate')),
+        When(unrated, then=Value(None)),
+        When(value=0, then=Value(models.RATINGS['zero'])),
+        When(value__lt=lower - delta, then=Value(models.RATINGS['basso'])),
+        When(value__gte=lower - delta, value__lte=lower + delta,
+             then=Value(models.RATINGS['limite inferiore'])),
+        When(value__gt=lower + delta, value__lt=upper - delta,
+             then=Value(models.RATINGS['normale'])),
+        When(value__gte=upper - delta, value__lte=upper + delta,
+             then=Value(models.RATINGS['limite superiore'])),
+        When(value__gt=upper + delta, then=Value(models.RATINGS['alto'])),
+        default=Value(None),
+        output_field=CharField(),
+    )
 
 
-class AnalysisManager(Manager):
+class AnalysisQuerySet(QuerySet):
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Store computed_rating of every object, then bulk_create them."""
+        objs = list(objs)
+        ratings = rate_arrays([o.value for o in objs],
+                              [o.lower_limit for o in objs],
+                              [o.upper_limit for o in objs],
+                              [o.rate for o in objs],
+                              tolerance=self.model._tolerance)
+        for obj, rating in zip(objs, ratings):
+            obj.computed_rating = rating
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def with_rating(self, name: str = 'live_rating'):
+        """Annotate the rating computed by the database as name.
+
+        Unlike the stored computed_rating it reflects the current _tolerance
+        and rows changed by update(), e.g.
+        with_rating().filter(live_rating__in=['b', 'a'])
+        """
+        return self.annotate(
+            **{name: rating_expression(self.model._tolerance)})
+
+    def series(self, patient, analytes=None) -> dict:
+        """Columnar time series of the analyses of a patient, by analyte.
+
+        analytes: short names or names to fetch (default: all). Return
+        {short_name: {'dates', 'keys', 'values', 'lower_limits',
+        'upper_limits', 'ratings', 'units'}}, each a list in date order,
+        with a single query and no model instances.
+        """
+        queryset = self.filter(patient=patient)
+        if analytes is not None:
+            queryset = queryset.filter(Q(name__short_name__in=analytes) |
+                                       Q(name__name__in=analytes))
+        rows = queryset.order_by('date', 'pk').values_list(
+            'name__short_name', 'date', 'value', 'lower_limit',
+            'upper_limit', 'computed_rating', 'unit')
+        series = {}
+        for analyte, date, value, lower, upper, rating, unit in rows:
+            columns = series.get(analyte)
+            if columns is None:
+                columns = series[analyte] = {
+                    'dates': [], 'keys': [], 'values': [], 'lower_limits': [],
+                    'upper_limits': [], 'ratings': [], 'units': []}
+            columns['dates'].append(str(date))
+            columns['keys'].append(date.key)
+            columns['values'].append(value)
+            columns['lower_limits'].append(lower)
+            columns['upper_limits'].append(upper)
+            columns['ratings'].append(rating)
+            columns['units'].append(unit)
+        return series
+
+    def ratings(self) -> dict:
+        """Return {pk: rating code}, computed all at once with NumPy.
+
+        Same results as Analysis.rating(), with a single query.
+        """
+        return rate_queryset(self)
+
+
+class AnalysisManager(Manager.from_queryset(AnalysisQuerySet)):
 
     translator = TextToAnalysisTranslator() # TODO: maybe yet too ugly...
+    names_index = analysis_names_index
+
+    @profile_hook('AnalysisManager.text_to_analysis')
+    def text_to_analysis(self, text: str, patient) -> tuple:
+        """Translate text and save all its analyses in a single transaction.
+
+        The Analysis rows are written with one bulk_create. Return
+        (analyses, diagnostics), where diagnostics has a dict per analyte
+        with its token, the resolved AnalysisName (or None), the candidate
+        names and a status: 'created', 'unknown' or 'ambiguous'. Unknown and
+        ambiguous analytes are not saved.
+        """
+        return self.lines_to_analysis([text], patient)
+
+    @profile_hook('AnalysisManager.lines_to_analysis')
+    def lines_to_analysis(self, lines, patient) -> tuple:
+        """Like text_to_analysis, for a block or an iterable of report lines.
+
+        The whole block is saved in one transaction with one bulk_create, so
+        nothing is saved if a line cannot be read.
+        """
+        analyses = []
+        diagnostics = []
+        snapshot = self.names_index.snapshot()
+        for date, analyses_data in self.translator.iter_parse(lines):
+            self.build_analyses(date, analyses_data, patient,
+                                analyses, diagnostics, snapshot)
+        with transaction.atomic(using=self.db):
+            analyses = self.bulk_create(analyses)
+        return analyses, diagnostics
+
+    def build_analyses(self, date, analyses_data, patient, analyses: list,
+                       diagnostics: list, snapshot: tuple = None) -> None:
+        """Append unsaved Analysis objects and their diagnostics.
 
-    def text_to_analysis(self, text: str, patient) -> None:
-        date, analyses_data = self.translator.text_to_analysis(text)
-        analyses_names = models.AnalysisName.objects.all()
+        snapshot is a names_index.snapshot() shared by the lines of a batch.
+        """
+        snapshot = snapshot or self.names_index.snapshot()
         for data in analyses_data:
-            analysis = data.pop('name')
-            analysis_name = analyses_names.filter(name__startswith=analysis) | \
-                analyses_names.filter(short_name__startswith=analysis)
-            name = analysis_name.first()
-            self.create(name=name, patient=patient, date=date, **data)
+            status, name, candidates = self.names_index.resolve(data.name,
+                                                                snapshot)
+            if status == FOUND:
+                analyses.append(self.model(
+                    name=name, patient=patient, date=date, value=data.value,
+                    rate=data.rate, lower_limit=data.lower_limit,
+                    upper_limit=data.upper_limit, unit=data.unit))
+                status = 'created'
+            diagnostics.append({'date': date, 'analyte': data.name,
+                                'name': name, 'candidates': candidates,
+                                'status': status})
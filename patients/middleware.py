@@ -0,0 +1,86 @@
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from .perf import RequestTimer, perf_stats
+from .profiling import Profile, profiling, request_profiling, \
+    set_request_profiling
+
+
+class PerformanceMiddleware:
+    """Measure every request: total time, SQL queries and time, and the
+    time spent rendering a TemplateResponse.
+
+    The measures are sent back as a Server-Timing header and recorded in
+    perf_stats under the URL name of the view. Put it first in MIDDLEWARE
+    so that the time of the other middleware is counted too. The time of
+    a streaming response only covers its creation.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = request.perf_timer = RequestTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+        response['Server-Timing'] = server_timing(total, timer)
+        perf_stats.record(url_name(request), total, timer)
+        return response
+
+    def process_template_response(self, request, response):
+        timer = getattr(request, 'perf_timer', None)
+        if timer is not None:
+            render = response.render
+
+            def timed_render():
+                start = time.perf_counter()
+                try:
+                    return render()
+                finally:
+                    timer.template += time.perf_counter() - start
+            response.render = timed_render
+        return response
+
+
+class ProfilingMiddleware:
+    """Profile the whole request of a staff user sending X-Profile: 1.
+
+    The profile is saved in the ring of patients.profiling and its id sent
+    back as the X-Profile-Id header. Put it after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if profiling() or not request_profiling(request):
+            return self.get_response(request)
+        set_request_profiling(True)
+        try:
+            with Profile('request') as profile:
+                response = self.get_response(request)
+                profile.name = f'request {url_name(request)}'
+        finally:
+            set_request_profiling(False)
+        if profile.id:
+            response['X-Profile-Id'] = profile.id
+        return response
+
+
+def url_name(request) -> str:
+    match = getattr(request, 'resolver_match', None)
+    if match is None or not match.url_name:
+        return '<unresolved>'
+    return match.view_name
+
+
+def server_timing(total: float, timer: RequestTimer) -> str:
+    return f'db;dur={timer.sql * 1000:.1f};desc="{timer.queries} queries", ' \
+           f'tpl;dur={timer.template * 1000:.1f}, ' \
+           f'total;dur={total * 1000:.1f}'
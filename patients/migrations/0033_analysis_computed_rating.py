@@ -0,0 +1,25 @@
+# Never applied by manage.py migrate: patients/migrations is not a package
+# (no __init__.py, and 0001-0020 are missing). manage.py upgrade_db is the
+# only supported upgrade path for existing databases, see
+# patients/upgrade.py; this file only records the schema change.
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0032_auto_20190218_1158'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='computed_rating',
+            field=models.CharField(blank=True, choices=[('0', 'zero'), ('b', 'basso'), ('li', 'limite inferiore'), ('n', 'normale'), ('ls', 'limite superiore'), ('a', 'alto')], editable=False, max_length=2, null=True, verbose_name='valutazione calcolata'),
+        ),
+        migrations.AddIndex(
+            model_name='analysis',
+            index=models.Index(fields=['computed_rating', 'date'], name='analysis_rating_date_idx'),
+        ),
+    ]
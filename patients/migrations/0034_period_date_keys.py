@@ -0,0 +1,27 @@
+# Never applied by manage.py migrate: patients/migrations is not a package
+# (no __init__.py, and 0001-0020 are missing). manage.py upgrade_db is the
+# only supported upgrade path for existing databases, see
+# patients/upgrade.py; this file only records the schema change.
+
+from django.db import migrations
+
+from patients.upgrade import convert_period_dates
+
+
+def forwards(apps, schema_editor):
+    convert_period_dates(schema_editor.connection.alias)
+
+
+def backwards(apps, schema_editor):
+    convert_period_dates(schema_editor.connection.alias, backwards=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0033_analysis_computed_rating'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
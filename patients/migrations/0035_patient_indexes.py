@@ -0,0 +1,24 @@
+# Never applied by manage.py migrate: patients/migrations is not a package
+# (no __init__.py, and 0001-0020 are missing). manage.py upgrade_db is the
+# only supported upgrade path for existing databases, see
+# patients/upgrade.py; this file only records the schema change.
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0034_period_date_keys'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['last_name', 'first_name', 'id'], name='patient_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['fiscal_code'], name='patient_fiscal_code_idx'),
+        ),
+    ]
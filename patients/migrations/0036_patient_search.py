@@ -0,0 +1,40 @@
+# Never applied by manage.py migrate: patients/migrations is not a package
+# (no __init__.py, and 0001-0020 are missing). manage.py upgrade_db is the
+# only supported upgrade path for existing databases, see
+# patients/upgrade.py; this file only records the schema change.
+
+from django.db import migrations
+
+from patients.search import COLUMNS, TABLE, patient_row
+
+
+def create_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Patient = apps.get_model('patients', 'Patient')
+    rows = [patient_row(*patient) for patient in Patient.objects.values_list(
+        'pk', 'last_name', 'first_name', 'birth_place', 'fiscal_code',
+        'birth_date')]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING "
+                       f"fts5({', '.join(COLUMNS)}, prefix='2 3 4')")
+        cursor.executemany(f"INSERT INTO {TABLE} (rowid, {', '.join(COLUMNS)})"
+                           f" VALUES (%s, %s, %s, %s, %s, %s)", rows)
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0035_patient_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
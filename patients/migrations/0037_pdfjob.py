@@ -0,0 +1,40 @@
+# Never applied by manage.py migrate: patients/migrations is not a package
+# (no __init__.py, and 0001-0020 are missing). manage.py upgrade_db is the
+# only supported upgrade path for existing databases, see
+# patients/upgrade.py; this file only records the schema change.
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0036_patient_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PDFJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(max_length=30, verbose_name='tipo')),
+                ('params', models.TextField(default='{}', verbose_name='parametri')),
+                ('status', models.CharField(choices=[('queued', 'in coda'), ('running', 'in corso'), ('done', 'completato'), ('failed', 'fallito')], default='queued', max_length=10, verbose_name='stato')),
+                ('file', models.FileField(blank=True, upload_to='pdf_jobs/', verbose_name='file')),
+                ('pages', models.PositiveIntegerField(blank=True, null=True, verbose_name='pagine')),
+                ('error', models.TextField(blank=True, verbose_name='errore')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='creato')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='iniziato')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='finito')),
+            ],
+            options={
+                'verbose_name': 'lavoro PDF',
+                'verbose_name_plural': 'lavori PDF',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='pdfjob',
+            index=models.Index(fields=['status', 'created'], name='pdfjob_status_created_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Never applied by manage.py migrate: patients/migrations is not a package
+# (no __init__.py, and 0001-0020 are missing). manage.py upgrade_db is the
+# only supported upgrade path for existing databases, see
+# patients/upgrade.py; this file only records the schema change.
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0037_pdfjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='exemption',
+            index=models.Index(fields=['patient', 'signature_date'], name='exemption_patient_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exemption',
+            index=models.Index(fields=['signature_date'], name='exemption_signature_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analysisname',
+            index=models.Index(fields=['short_name'], name='analysisname_short_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analysisname',
+            index=models.Index(fields=['name'], name='analysisname_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analysis',
+            index=models.Index(fields=['patient', 'date'], name='analysis_patient_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analysis',
+            index=models.Index(fields=['patient', 'name', 'date'], name='analysis_patient_name_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bmd',
+            index=models.Index(fields=['patient', 'date'], name='bmd_patient_date_idx'),
+        ),
+    ]
@@ -1,3 +1,5 @@
+import uuid
+
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.db import models
@@ -45,6 +47,12 @@ class Patient(models.Model): # TODO: make fields mandatory
     class Meta:
         verbose_name = 'paziente'
         verbose_name_plural = 'pazienti'
+        indexes = [
+            models.Index(fields=['last_name', 'first_name', 'id'],
+                         name='patient_name_idx'),
+            models.Index(fields=['fiscal_code'],
+                         name='patient_fiscal_code_idx'),
+        ]
 
 
 class ExemptionCodes(models.Model):
@@ -103,6 +111,14 @@ class Exemption(models.Model):
     class Meta:
         verbose_name = 'esenzione'
         verbose_name_plural = 'esenzioni'
+        indexes = [
+            # exemptions of a patient, newest first (patient detail)
+            models.Index(fields=['patient', 'signature_date'],
+                         name='exemption_patient_date_idx'),
+            # batch printing by signature date
+            models.Index(fields=['signature_date'],
+                         name='exemption_signature_date_idx'),
+        ]
 
 
 class Center(models.Model):
@@ -143,6 +159,11 @@ class AnalysisName(models.Model):
     class Meta:
         verbose_name = 'tipo analisi'
         verbose_name_plural = "tipi analisi"
+        indexes = [
+            models.Index(fields=['short_name'],
+                         name='analysisname_short_name_idx'),
+            models.Index(fields=['name'], name='analysisname_name_idx'),
+        ]
 
 
 class Analysis(ClinicalElement):
@@ -159,6 +180,11 @@ class Analysis(ClinicalElement):
                                     verbose_name='limite superiore')
     unit = models.CharField(max_length=10, verbose_name='unità di misura',
                             blank=True, null=True)
+    # rating() stored on save() and bulk_create(): run recompute_ratings
+    # after QuerySet.update() of the limits or a change of _tolerance
+    computed_rating = models.CharField(max_length=2, choices=RATING_CHOICES,
+                                       blank=True, null=True, editable=False,
+                                       verbose_name='valutazione calcolata')
     objects = AnalysisManager()
     _tolerance = 0.05
 
@@ -167,6 +193,7 @@ class Analysis(ClinicalElement):
         if self.rate: return self.rate
         if not self.lower_limit: return None
         if not self.upper_limit: return None
+        if self.value is None: return None
 
         range = self.upper_limit - self.lower_limit
         delta = range * self._tolerance
@@ -190,6 +217,13 @@ class Analysis(ClinicalElement):
             return
         raise ValidationError('Either value or rate must be set.')
 
+    def save(self, *args, **kwargs):
+        self.computed_rating = self.rating()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'computed_rating'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
 
         form = f"{str(self.date)} {self.name.short_name} " # TODO: return better date
@@ -198,11 +232,22 @@ class Analysis(ClinicalElement):
             if self.unit:
                 form = ' ' + form + ' ' + self.unit
             return form
-        return form + '(' + self.rating() + ')'
+        rating = self.rating()
+        return form + f'({rating})' if rating else form
 
     class Meta:
         verbose_name = 'analisi'
         verbose_name_plural = 'analisi'
+        indexes = [
+            models.Index(fields=['computed_rating', 'date'],
+                         name='analysis_rating_date_idx'),
+            # analyses of a patient by date (detail, series)
+            models.Index(fields=['patient', 'date'],
+                         name='analysis_patient_date_idx'),
+            # one analyte of a patient over time
+            models.Index(fields=['patient', 'name', 'date'],
+                         name='analysis_patient_name_date_idx'),
+        ]
 
 
 class BMD(ClinicalElement):
@@ -223,6 +268,52 @@ class BMD(ClinicalElement):
     class Meta:
         verbose_name = 'MOC'
         verbose_name_plural = 'MOC'
+        indexes = [
+            models.Index(fields=['patient', 'date'],
+                         name='bmd_patient_date_idx'),
+        ]
+
+
+class PDFJob(models.Model):
+    """A PDF rendered in background by manage.py run_pdf_workers.
+
+    See patients.jobs: kind names the renderer and params holds its
+    (JSON encoded) form data.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = ((QUEUED, 'in coda'), (RUNNING, 'in corso'),
+                      (DONE, 'completato'), (FAILED, 'fallito'))
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4,
+                          editable=False)
+    kind = models.CharField(max_length=30, verbose_name='tipo')
+    params = models.TextField(default='{}', verbose_name='parametri')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=QUEUED, verbose_name='stato')
+    file = models.FileField(upload_to='pdf_jobs/', blank=True,
+                            verbose_name='file')
+    pages = models.PositiveIntegerField(null=True, blank=True,
+                                        verbose_name='pagine')
+    error = models.TextField(blank=True, verbose_name='errore')
+    created = models.DateTimeField(auto_now_add=True, verbose_name='creato')
+    started = models.DateTimeField(null=True, blank=True,
+                                   verbose_name='iniziato')
+    finished = models.DateTimeField(null=True, blank=True,
+                                    verbose_name='finito')
+
+    def __str__(self):
+        return f"{self.kind} {self.pk} ({self.status})"
+
+    class Meta:
+        verbose_name = 'lavoro PDF'
+        verbose_name_plural = 'lavori PDF'
+        indexes = [
+            models.Index(fields=['status', 'created'],
+                         name='pdfjob_status_created_idx'),
+        ]
 
 
 # class TestModel(models.Model):
@@ -0,0 +1,152 @@
+"""Request timings, aggregated per URL name.
+
+PerformanceMiddleware (see middleware.py) measures every request and
+records it in perf_stats, which keeps the last PERF_STATS_WINDOW samples
+of each metric per URL name and computes their percentiles. Each process
+has its own perf_stats, so every PERF_STATS_INTERVAL seconds it writes a
+snapshot of its samples to PERF_STATS_DIR/<pid>.json; manage.py
+perf_stats merges the snapshots of all the processes.
+"""
+import json
+import os
+import tempfile
+import time
+from collections import deque
+from threading import Lock
+
+from django.conf import settings
+
+METRICS = ('total', 'sql', 'queries', 'template')
+
+
+class RequestTimer:
+    """SQL count and time of a request, as a connection.execute_wrapper."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.template = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += time.perf_counter() - start
+            self.queries += 1
+
+
+def percentile(ordered: list, fraction: float):
+    """Nearest-rank percentile of a sorted, non-empty list."""
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(samples: dict) -> dict:
+    """{url name: {metric: [values]}} to the count and the p50, p90, p99
+    and max of each metric."""
+    summary = {}
+    for name, metrics in samples.items():
+        summary[name] = {'count': len(metrics['total'])}
+        for metric in METRICS:
+            ordered = sorted(metrics[metric])
+            summary[name][metric] = {
+                'p50': percentile(ordered, 0.5),
+                'p90': percentile(ordered, 0.9),
+                'p99': percentile(ordered, 0.99),
+                'max': ordered[-1],
+            } if ordered else None
+    return summary
+
+
+class PerfStats:
+    """Rolling windows of the request metrics, per URL name."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._samples = {}
+        self._last_snapshot = time.monotonic()
+
+    @property
+    def window(self) -> int:
+        return getattr(settings, 'PERF_STATS_WINDOW', 1000)
+
+    def record(self, name: str, total: float, timer: RequestTimer) -> None:
+        values = (total, timer.sql, timer.queries, timer.template)
+        with self._lock:
+            metrics = self._samples.get(name)
+            if metrics is None:
+                metrics = self._samples[name] = {
+                    metric: deque(maxlen=self.window) for metric in METRICS}
+            for metric, value in zip(METRICS, values):
+                metrics[metric].append(value)
+        self.maybe_snapshot()
+
+    def samples(self) -> dict:
+        """A copy of the windows, as {url name: {metric: [values]}}."""
+        with self._lock:
+            return {name: {metric: list(values)
+                           for metric, values in metrics.items()}
+                    for name, metrics in self._samples.items()}
+
+    def summary(self) -> dict:
+        return summarize(self.samples())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._samples = {}
+
+    def maybe_snapshot(self) -> None:
+        directory = getattr(settings, 'PERF_STATS_DIR', None)
+        interval = getattr(settings, 'PERF_STATS_INTERVAL', 60)
+        now = time.monotonic()
+        if directory is None or now - self._last_snapshot < interval:
+            return
+        self._last_snapshot = now
+        try:
+            self.snapshot(directory)
+        except OSError:
+            pass  # the statistics must never break a request
+
+    def snapshot(self, directory: str) -> str:
+        """Write the samples of this process to directory/<pid>.json."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        data = {'pid': os.getpid(), 'time': time.time(),
+                'samples': self.samples()}
+        with tempfile.NamedTemporaryFile('w', dir=directory, delete=False,
+                                         suffix='.tmp') as file:
+            json.dump(data, file)
+        os.replace(file.name, path)
+        return path
+
+
+def load_snapshots(directory: str, max_age: float = None) -> tuple:
+    """Merge the snapshots in directory; return (processes, samples).
+
+    max_age: ignore the snapshots older than that many seconds.
+    """
+    merged = {}
+    processes = 0
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        names = []
+    for file_name in names:
+        if not file_name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, file_name)) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            continue
+        if max_age is not None and time.time() - data['time'] > max_age:
+            continue
+        processes += 1
+        for name, metrics in data['samples'].items():
+            target = merged.setdefault(name, {m: [] for m in METRICS})
+            for metric in METRICS:
+                target[metric].extend(metrics.get(metric, []))
+    return processes, merged
+
+
+perf_stats = PerfStats()
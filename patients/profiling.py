@@ -0,0 +1,160 @@
+"""Opt-in cProfile hooks around the hot paths.
+
+The functions decorated with profile_hook() run under cProfile when
+profiling is on: in every process with settings.PROFILE_HOOKS, or for a
+single request of a staff user sending the X-Profile header (see
+ProfilingMiddleware, which then profiles the whole request). The hooks
+nest: inside a running profile they add nothing of their own.
+
+Every profile is saved in the ring PROFILE_DIR (the newest PROFILE_KEEP
+ones are kept) as <id>.prof, readable with pstats, with the <id>.json of
+its name, duration and passive counters; manage.py profiles lists and
+summarizes them.
+
+Passive hooks (profile_hook(name, passive=True)) are for the functions
+called once per row, too often to start a profiler: they only count
+their calls and time inside the running profile.
+"""
+import cProfile
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+
+_state = threading.local()
+_NAME_RE = re.compile(r'[^\w.-]+')
+
+
+def profile_dir() -> str:
+    return getattr(settings, 'PROFILE_DIR', None)
+
+
+def hooks_enabled() -> bool:
+    return getattr(settings, 'PROFILE_HOOKS', False) or \
+        getattr(_state, 'request', False)
+
+
+def profiling() -> bool:
+    """Whether a profile is running in this thread."""
+    return getattr(_state, 'counters', None) is not None
+
+
+def profile_hook(name: str, passive: bool = False):
+    """Decorator profiling the calls to a function as name."""
+    def decorator(function):
+        if passive:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                counters = getattr(_state, 'counters', None)
+                if counters is None:
+                    return function(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    calls, elapsed = counters.get(name, (0, 0.0))
+                    counters[name] = (calls + 1,
+                                      elapsed + time.perf_counter() - start)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if profiling() or not hooks_enabled():
+                    return function(*args, **kwargs)
+                with Profile(name):
+                    return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Profile:
+    """Context manager profiling its block and saving it in the ring."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.id = None
+        self.profiler = cProfile.Profile()
+
+    def __enter__(self):
+        _state.counters = {}
+        self.start = time.perf_counter()
+        try:
+            self.profiler.enable()
+        except ValueError:
+            # another profiler is active (Python >= 3.12 allows only one)
+            self.profiler = None
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        counters = _state.counters
+        _state.counters = None
+        if self.profiler is None:
+            return
+        self.profiler.disable()
+        directory = profile_dir()
+        if directory:
+            try:
+                self.id = save(directory, self.name, self.profiler,
+                               duration, counters)
+            except OSError:
+                pass  # profiling must never break the profiled code
+
+
+def save(directory: str, name: str, profiler, duration: float,
+         counters: dict) -> str:
+    """Write a profile to the ring and drop the oldest; return its id."""
+    os.makedirs(directory, exist_ok=True)
+    profile_id = f'{time.time_ns()}-{os.getpid()}-' \
+                 f'{threading.get_ident()}-{_NAME_RE.sub("_", name)}'
+    path = os.path.join(directory, profile_id)
+    profiler.dump_stats(path + '.prof')
+    with open(path + '.json', 'w') as file:
+        json.dump({'id': profile_id, 'name': name, 'pid': os.getpid(),
+                   'time': time.time(), 'duration': duration,
+                   'counters': counters}, file)
+    prune(directory, getattr(settings, 'PROFILE_KEEP', 100))
+    return profile_id
+
+
+def profile_ids(directory: str) -> list:
+    """The ids of the profiles in the ring, oldest first."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    # ids start with the time in ns, all with the same number of digits
+    return sorted(name[:-5] for name in names if name.endswith('.prof'))
+
+
+def prune(directory: str, keep: int) -> None:
+    ids = profile_ids(directory)
+    for profile_id in ids[:max(len(ids) - keep, 0)]:
+        for suffix in ('.prof', '.json'):
+            try:
+                os.remove(os.path.join(directory, profile_id + suffix))
+            except FileNotFoundError:
+                pass  # pruned by another process
+
+
+def load_meta(directory: str, profile_id: str) -> dict:
+    try:
+        with open(os.path.join(directory, profile_id + '.json')) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {'id': profile_id, 'name': '?', 'time': None,
+                'duration': None, 'counters': {}}
+
+
+def request_profiling(request) -> bool:
+    """Whether request asked to be profiled (staff users only)."""
+    user = getattr(request, 'user', None)
+    return bool(request.META.get('HTTP_X_PROFILE')) and \
+        user is not None and user.is_staff
+
+
+def set_request_profiling(enabled: bool) -> None:
+    _state.request = enabled
@@ -0,0 +1,126 @@
+"""The hot queries of djambu and a check of their SQLite query plans.
+
+Every function of HOT_QUERIES returns a queryset shaped like one run by a
+view or a command, see the comments. table_scans() runs EXPLAIN QUERY
+PLAN on it and returns the full table scans of the plan: the tests fail
+when a hot query stops using an index.
+"""
+import datetime
+import re
+
+from django.db import connections
+
+from patients import models
+from .tools import ItalianPeriodDate, prefix_range
+
+# 'SCAN patients_analysis' ('SCAN TABLE ...' before SQLite 3.36), but not
+# 'SCAN patients_patient USING INDEX ...'
+_TABLE_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+
+HOT_QUERIES = {}
+
+
+def hot_query(function):
+    HOT_QUERIES[function.__name__] = function
+    return function
+
+
+@hot_query
+def patients_first_page():
+    # PatientsListView
+    return models.Patient.objects.order_by('last_name', 'first_name',
+                                           'pk')[:51]
+
+
+@hot_query
+def patients_by_name():
+    # PatientsListView ?q=ross mar
+    return models.Patient.objects.filter(
+        prefix_range('last_name', 'ross'),
+        prefix_range('first_name', 'mar'),
+    ).order_by('last_name', 'first_name', 'pk')[:51]
+
+
+@hot_query
+def patients_by_fiscal_code():
+    # PatientsListView ?q=RSSMRA, import_lab_reports
+    return models.Patient.objects.filter(
+        prefix_range('fiscal_code', 'RSSMRA'))
+
+
+@hot_query
+def patient_exemptions():
+    # PatientDetailView prefetch
+    return models.Exemption.objects.select_related('exemption').filter(
+        patient_id__in=[1]).order_by('-signature_date', '-pk')
+
+
+@hot_query
+def patient_analyses():
+    # PatientDetailView prefetch
+    return models.Analysis.objects.select_related('name').filter(
+        patient_id__in=[1]).order_by('-date', 'name__short_name')
+
+
+@hot_query
+def patient_bmds():
+    # PatientDetailView prefetch
+    return models.BMD.objects.filter(patient_id__in=[1]).order_by('-date')
+
+
+@hot_query
+def patient_series():
+    # AnalysisQuerySet.series
+    return models.Analysis.objects.filter(patient_id=1).order_by(
+        'date', 'pk').values_list('name__short_name', 'date', 'value')
+
+
+@hot_query
+def patient_analyte_series():
+    # AnalysisQuerySet.series(analytes=...) by AnalysisName pk
+    return models.Analysis.objects.filter(patient_id=1, name_id=1).order_by(
+        'date')
+
+
+@hot_query
+def analysis_names():
+    # analytes by short name
+    return models.AnalysisName.objects.filter(short_name__in=['TSH', 'FT4'])
+
+
+@hot_query
+def exemptions_signed_on():
+    # ExemptionBatchForm.exemptions
+    day = datetime.date(2019, 3, 1)
+    return models.Exemption.objects.select_related(
+        'exemption', 'signature_place').filter(
+        signature_date__gte=day, signature_date__lte=day).order_by(
+        'signature_date', 'pk')
+
+
+@hot_query
+def analyses_by_rating():
+    # with_rating / computed_rating reports
+    return models.Analysis.objects.filter(
+        computed_rating='a', date__gte=ItalianPeriodDate.fromstring('1/2019'))
+
+
+@hot_query
+def queued_pdf_jobs():
+    # PDFJobQueue.claim
+    return models.PDFJob.objects.filter(
+        status=models.PDFJob.QUEUED).order_by('created')[:10]
+
+
+def explain(queryset) -> list:
+    """The detail lines of the SQLite query plan of queryset."""
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def table_scans(queryset) -> list:
+    """The tables that the query plan of queryset reads in full."""
+    return [match.group(1) for match in
+            map(_TABLE_SCAN_RE.match, explain(queryset)) if match]
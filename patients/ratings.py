@@ -0,0 +1,51 @@
+"""Rating of many analyses at once, vectorized with NumPy."""
+import numpy as np
+
+from patients import models
+
+
+def rate_arrays(values, lower_limits, upper_limits, rates=None,
+                tolerance: float = 0.05) -> np.ndarray:
+    """Return the rating codes of many analyses as an object array.
+
+    Arguments are sequences of the same length (None for missing values);
+    the result is the same as calling Analysis.rating() on each analysis.
+    """
+    value = np.array(values, dtype=float)
+    lower = np.array(lower_limits, dtype=float)
+    upper = np.array(upper_limits, dtype=float)
+    ratings = np.full(value.shape, None, dtype=object)
+    # a missing or zero limit leaves the analysis unrated
+    limited = (lower != 0) & ~np.isnan(lower) & (upper != 0) & ~np.isnan(upper)
+    delta = (upper - lower) * tolerance
+    conditions = (
+        (value == 0, models.RATINGS['zero']),
+        (value < lower - delta, models.RATINGS['basso']),
+        ((lower - delta <= value) & (value <= lower + delta),
+         models.RATINGS['limite inferiore']),
+        ((lower + delta < value) & (value < upper - delta),
+         models.RATINGS['normale']),
+        ((upper - delta <= value) & (value <= upper + delta),
+         models.RATINGS['limite superiore']),
+        (value > upper + delta, models.RATINGS['alto']),
+    )
+    # the first matching condition wins, as in the elif chain of rating()
+    for condition, code in reversed(conditions):
+        ratings[condition & limited] = code
+    if rates is not None:
+        rates = np.array(rates, dtype=object)
+        rated = np.array([bool(rate) for rate in rates], dtype=bool)
+        ratings[rated] = rates[rated]
+    return ratings
+
+
+def rate_queryset(queryset) -> dict:
+    """Return {pk: rating code} for an Analysis queryset, in one query."""
+    rows = list(queryset.values_list('pk', 'value', 'lower_limit',
+                                     'upper_limit', 'rate'))
+    if not rows:
+        return {}
+    pks, values, lower_limits, upper_limits, rates = zip(*rows)
+    ratings = rate_arrays(values, lower_limits, upper_limits, rates,
+                          tolerance=queryset.model._tolerance)
+    return dict(zip(pks, ratings))
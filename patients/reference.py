@@ -0,0 +1,85 @@
+"""Cached copies of the small reference tables.
+
+ExemptionCodes, Place and AnalysisName change rarely, but they are read by
+every patient page (RapidExemptionForm choices), by the admin forms and by
+every paste of analyses. A ReferenceTable keeps all the rows of its table
+in the REFERENCE_CACHE cache under a versioned key, plus a copy in the
+process for the current version: reading it costs a cache get of the
+version and no query. The post_save and post_delete signals (see
+signals.py) change the version, so every process sharing the cache
+reloads the table on its next read.
+"""
+import uuid
+from threading import Lock
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+
+
+class ReferenceTable:
+
+    def __init__(self, label: str, ordering=('pk',)):
+        self.label = label
+        self.ordering = ordering
+        self._lock = Lock()
+        self._local = (None, {})
+
+    @property
+    def model(self):
+        return apps.get_model(self.label)
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'REFERENCE_CACHE', 'default')]
+
+    def key(self, suffix: str) -> str:
+        return f'reference:{self.label}:{suffix}'
+
+    def version(self) -> str:
+        version = self.cache.get(self.key('version'))
+        if version is None:
+            version = uuid.uuid4().hex
+            if not self.cache.add(self.key('version'), version, None):
+                version = self.cache.get(self.key('version'), version)
+        return version
+
+    def invalidate(self) -> None:
+        # a new random version, never an old one evicted from the cache
+        self.cache.set(self.key('version'), uuid.uuid4().hex, None)
+
+    def load(self) -> tuple:
+        """Return (version, {pk: instance}) of the current version."""
+        version = self.version()
+        local = self._local
+        if local[0] == version:
+            return local
+        with self._lock:
+            if self._local[0] != version:
+                rows = self.cache.get(self.key(version))
+                if rows is None:
+                    rows = list(self.model._default_manager
+                                .order_by(*self.ordering))
+                    self.cache.set(self.key(version), rows, None)
+                self._local = (version, {row.pk: row for row in rows})
+            return self._local
+
+    def all(self) -> list:
+        return list(self.load()[1].values())
+
+    def get(self, pk):
+        """The instance with primary key pk, or None."""
+        return self.load()[1].get(pk)
+
+
+exemption_codes = ReferenceTable('patients.exemptioncodes')
+places = ReferenceTable('patients.place')
+analysis_names = ReferenceTable('patients.analysisname')
+
+REFERENCE_TABLES = {table.label: table
+                    for table in (exemption_codes, places, analysis_names)}
+
+
+def reference_table(model):
+    """The ReferenceTable of model, or None."""
+    return REFERENCE_TABLES.get(model._meta.label_lower)
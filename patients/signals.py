@@ -0,0 +1,44 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from .databases import apply_sqlite_pragmas
+from .models import Patient
+from .reference import reference_table
+from .search import PatientSearchIndex, patient_search_index
+
+
+@receiver([post_save, post_delete])
+def invalidate_reference_table(sender, using, **kwargs):
+    table = reference_table(sender)
+    if table is not None:
+        # now, for the reads of this transaction, and again on commit:
+        # another process may have cached the old rows under the first
+        # new version before the commit
+        table.invalidate()
+        transaction.on_commit(table.invalidate, using=using)
+
+
+@receiver(post_save, sender=Patient)
+def index_patient(sender, instance, raw=False, **kwargs):
+    if not raw:
+        patient_search_index.update(instance)
+
+
+@receiver(post_delete, sender=Patient)
+def unindex_patient(sender, instance, **kwargs):
+    patient_search_index.remove(instance.pk)
+
+
+@receiver(post_migrate, sender=apps.get_app_config('patients'))
+def create_patient_search_table(sender, using='default', **kwargs):
+    index = PatientSearchIndex(using)
+    if index.available():
+        index.create_table()
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    apply_sqlite_pragmas(connection)
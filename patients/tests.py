@@ -1,5 +1,35 @@
-from django.test import TestCase
+import base64
+import datetime
+import io
+import json
+import os
+import pickle
+import re
+import tempfile
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from patients import bench, certificates, queryplans
+from patients.databases import ReplicaRouter, apply_sqlite_pragmas, \
+    use_replica
+from patients.forms import ExemptionBatchForm, RapidExemptionForm, \
+    ReferenceChoiceField
+from patients.jobs import pdf_job_queue
+from patients.perf import perf_stats
+from patients.profiling import load_meta, profile_ids
 from patients.models import *
+from patients.ratings import rate_arrays
+from patients.reference import REFERENCE_TABLES, analysis_names, places
+from patients.search import PatientSearchIndex, patient_search_index
+from patients.tools import ItalianPeriodDate, TextToAnalysisTranslator, \
+    encode_cursor
+from patients.upgrade import convert_period_dates, from_key, to_key
+from patients.views import PatientsListView, PDFResponseView
 
 
 class AnalysisTestCase(TestCase):
@@ -63,6 +93,73 @@ class AnalysisTestCase(TestCase):
         pth = Analysis.objects.get(name__short_name='PTH')
         self.assertEqual(pth.rating(), 'n')
 
+    def test_bulk_ratings_match_rating(self):
+        ratings = Analysis.objects.ratings()
+        self.assertEqual(len(ratings), 5)
+        for analysis in Analysis.objects.all():
+            self.assertEqual(ratings[analysis.pk], analysis.rating())
+
+    def test_rate_arrays_match_rating(self):
+        values = [None, 0, 1, 4.9, 5, 5.1, 10, 50, 95, 100, 105.1, 200]
+        limits = [(None, None), (5, None), (None, 100), (0, 100), (5, 100),
+                  (100, 5), (5.0, 5.0)]
+        rows = [(value, lower, upper, rate)
+                for value in values for lower, upper in limits
+                for rate in (None, '', 'a')]
+        ratings = rate_arrays(*zip(*rows), tolerance=Analysis._tolerance)
+        for (value, lower, upper, rate), rating in zip(rows, ratings):
+            analysis = Analysis(value=value, lower_limit=lower,
+                                upper_limit=upper, rate=rate)
+            self.assertEqual(rating, analysis.rating(),
+                             (value, lower, upper, rate))
+
+    def test_with_rating_matches_rating(self):
+        name = AnalysisName.objects.get(short_name='TSH')
+        patient = Patient.objects.get()
+        for value in [None, 0, 1, 4.9, 5, 5.1, 10, 50, 95, 100, 105.1, 200]:
+            for lower, upper in [(None, 100), (0, 100), (5, 100), (100, 5)]:
+                for rate in (None, '', 'a'):
+                    Analysis.objects.create(
+                        name=name, patient=patient, value=value,
+                        lower_limit=lower, upper_limit=upper, rate=rate)
+        for analysis in Analysis.objects.with_rating():
+            self.assertEqual(analysis.live_rating, analysis.rating(),
+                             analysis.pk)
+            self.assertEqual(analysis.computed_rating, analysis.rating(),
+                             analysis.pk)
+
+    def test_filter_by_rating(self):
+        abnormal = Analysis.objects.with_rating().filter(
+            live_rating__in=[RATINGS['basso'], RATINGS['alto']])
+        self.assertEqual([a.name.short_name for a in abnormal], ['testo'])
+
+    def test_stored_rating(self):
+        abnormal = Analysis.objects.filter(
+            computed_rating__in=[RATINGS['basso'], RATINGS['alto']])
+        self.assertEqual([a.name.short_name for a in abnormal], ['testo'])
+        testo = abnormal.get()
+        testo.upper_limit = 200
+        testo.save(update_fields=['upper_limit'])
+        testo.refresh_from_db()
+        self.assertEqual(testo.computed_rating, RATINGS['normale'])
+
+    def test_bulk_create_stores_rating(self):
+        name = AnalysisName.objects.get(short_name='TSH')
+        patient = Patient.objects.get()
+        Analysis.objects.bulk_create([
+            Analysis(name=name, patient=patient, value=v, lower_limit=1,
+                     upper_limit=4) for v in (0.1, 2, 9)])
+        self.assertEqual(
+            list(Analysis.objects.filter(value__lt=10).order_by('value')
+                 .values_list('computed_rating', flat=True)),
+            [RATINGS['basso'], RATINGS['normale'], RATINGS['alto']])
+
+    def test_recompute_ratings(self):
+        Analysis.objects.update(computed_rating=None)
+        call_command('recompute_ratings', chunk_size=2, stdout=io.StringIO())
+        for analysis in Analysis.objects.all():
+            self.assertEqual(analysis.computed_rating, analysis.rating())
+
 
 class TextToAnalysisTestCase(TestCase):
 
@@ -144,6 +241,1113 @@ class TextToAnalysisTestCase(TestCase):
         Analysis.objects.text_to_analysis(self.MULTIPLE_ANALYTES, self.patient)
         print(Analysis.objects.all())
 
+    def test_bulk_multiple_analytes(self):
+        analyses, diagnostics = Analysis.objects.text_to_analysis(
+            self.MULTIPLE_ANALYTES, self.patient)
+        self.assertEqual(len(analyses), 5)
+        self.assertEqual(Analysis.objects.count(), 5)
+        self.assertEqual([d['status'] for d in diagnostics], ['created'] * 5)
+        corti = Analysis.objects.get(name__short_name='corti')
+        self.assertEqual(corti.value, 23.5)
+        self.assertEqual(corti.upper_limit, 22.0)
+
+    def test_bulk_unknown_analyte(self):
+        text = '- 01/01/2019 TSH 3.15, XYZ 12'
+        analyses, diagnostics = Analysis.objects.text_to_analysis(
+            text, self.patient)
+        self.assertEqual(len(analyses), 1)
+        self.assertEqual(diagnostics[1]['analyte'], 'xyz')
+        self.assertEqual(diagnostics[1]['status'], 'unknown')
+        self.assertEqual(Analysis.objects.count(), 1)
+
+    def test_lines_to_analysis(self):
+        block = '- 01/01/2019 TSH 3.15, FT4 n\n- 01/02/2019 TSH 2.8\n'
+        analyses, diagnostics = Analysis.objects.lines_to_analysis(
+            block, self.patient)
+        self.assertEqual(len(analyses), 3)
+        self.assertEqual(Analysis.objects.filter(name__short_name='TSH').count(), 2)
+        self.assertEqual(diagnostics[2]['date'], '01/02/2019')
+
+    def test_lines_to_analysis_is_atomic(self):
+        lines = ['- 01/01/2019 TSH 3.15', '- 01/02/2019 TSH']
+        with self.assertRaises(ValueError):
+            Analysis.objects.lines_to_analysis(lines, self.patient)
+        self.assertEqual(Analysis.objects.count(), 0)
+
+    def test_resolves_names_without_queries(self):
+        Analysis.objects.names_index.resolve('tsh')
+        with self.assertNumQueries(0):
+            status, name, candidates = \
+                Analysis.objects.names_index.resolve('corti')
+        self.assertEqual(status, 'found')
+        self.assertEqual(name.name, 'cortisolo')
+
+    def test_version_is_read_once_per_batch(self):
+        lines = [f'- 0{i}/01/2019 TSH 3.15, corti 12, FT4 1.2'
+                 for i in range(1, 6)]
+        with mock.patch.object(analysis_names, 'version',
+                               wraps=analysis_names.version) as version:
+            analyses, _ = Analysis.objects.lines_to_analysis(lines,
+                                                             self.patient)
+        self.assertEqual(len(analyses), 15)
+        self.assertEqual(version.call_count, 1)
+
+    def test_ambiguous_analyte_is_reported(self):
+        text = '- 01/01/2019 corti 12, FT 3, cort 1'
+        analyses, diagnostics = Analysis.objects.text_to_analysis(
+            text, self.patient)
+        self.assertEqual(len(analyses), 1)
+        self.assertEqual([d['status'] for d in diagnostics],
+                         ['created', 'ambiguous', 'ambiguous'])
+        self.assertEqual({n.short_name for n in diagnostics[1]['candidates']},
+                         {'FT3', 'FT4'})
+
+    def test_view_shows_analytes_not_saved(self):
+        patient = Patient.objects.create(
+            last_name='pozzi', first_name='plutoso', sex='m',
+            birth_date='2019-01-01', birth_place='carvico')
+        response = self.client.post(reverse('patients:test'), {
+            'text': '- 01/01/2019 corti 12, FT 3, PRL 8',
+            'patient': patient.pk}, follow=True)
+        self.assertContains(response, 'ft: analita ambiguo (FT4, FT3), '
+                                      'non salvato')
+        self.assertContains(response, 'prl: analita sconosciuto, '
+                                      'non salvato')
+        self.assertEqual(patient.analysis_set.count(), 1)
+
+    def test_view_reports_malformed_text(self):
+        patient = Patient.objects.create(
+            last_name='pozzi', first_name='plutoso', sex='m',
+            birth_date='2019-01-01', birth_place='carvico')
+        for text in ('TSH 3.15', '- 01/01/2019 TSH, FT4 n'):
+            response = self.client.post(reverse('patients:test'), {
+                'text': text, 'patient': patient.pk})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.context['form'].errors['text'])
+            self.assertContains(response, 'errorlist')
+        self.assertEqual(patient.analysis_set.count(), 0)
+
+    def test_index_is_invalidated_on_save(self):
+        status, name, candidates = Analysis.objects.names_index.resolve('prl')
+        self.assertEqual(status, 'unknown')
+        AnalysisName.objects.create(name='prolattina', short_name='PRL')
+        status, name, candidates = Analysis.objects.names_index.resolve('prl')
+        self.assertEqual(name.name, 'prolattina')
+
+
+class TextToAnalysisTranslatorTestCase(TestCase):
+
+    def setUp(self):
+        self.translator = TextToAnalysisTranslator()
+
+    def test_parse_records(self):
+        date, analyses = self.translator.parse(
+            '- 01/01/2019 TSH 3.15 mU/L (0.4-4.0), FT4 n, corti 23.5 (<22.0).')
+        self.assertEqual(date, '01/01/2019')
+        self.assertEqual([a.name for a in analyses], ['tsh', 'ft4', 'corti'])
+        self.assertEqual(analyses[0].unit, 'mu/l')
+        self.assertEqual((analyses[0].lower_limit, analyses[0].upper_limit),
+                         (0.4, 4.0))
+        self.assertEqual(analyses[1].rate, 'n')
+        self.assertIsNone(analyses[2].lower_limit)
+
+    def test_text_to_analysis_keeps_dict_shape(self):
+        date, analyses = self.translator.text_to_analysis('- 1/2/2019 FT3 3.2')
+        expected = dict(EMPTY_ANALYSIS_DATA, name='ft3', value=3.2)
+        self.assertEqual(analyses, [expected])
+
+    def test_lone_trailing_dot(self):
+        date, analyses = self.translator.text_to_analysis(
+            '- 01/01/2019 corti 12 (1-2) ., TSH 3 ng/ml .')
+        self.assertEqual(analyses, [
+            dict(EMPTY_ANALYSIS_DATA, name='corti', value=12.0,
+                 lower_limit=1.0, upper_limit=2.0),
+            dict(EMPTY_ANALYSIS_DATA, name='tsh', value=3.0, unit='ng/ml')])
+
+    def test_malformed_analysis(self):
+        with self.assertRaises(ValueError):
+            self.translator.parse('- 01/01/2019 TSH, FT4 n')
+        with self.assertRaises(ValueError):
+            self.translator.parse('- 01/01/2019 corti 3 (a-b)')
+
+    def test_iter_text_to_analysis(self):
+        block = '- 01/01/2019 TSH 3.15\n\n- 1/2/2019 TSH 2.1, FT4 n\n'
+        parsed = self.translator.iter_text_to_analysis(block)
+        date, analyses = next(parsed)
+        self.assertEqual(date, '01/01/2019')
+        self.assertEqual(analyses[0]['value'], 3.15)
+        date, analyses = next(parsed)
+        self.assertEqual(date, '1/2/2019')
+        self.assertEqual(len(analyses), 2)
+        with self.assertRaises(StopIteration):
+            next(parsed)
+
+
+class ImportLabReportsTestCase(TestCase):
+
+    def setUp(self):
+        Patient.objects.create(last_name='pippo', first_name='plutoso',
+                               sex='m', birth_date='2019-01-01',
+                               birth_place='carvico',
+                               fiscal_code='PPPPLT19A01B836X')
+        AnalysisName.objects.create(name='tireotropina', short_name='TSH')
+        AnalysisName.objects.create(name='levotiroxina libera', short_name='FT4')
+        self.file = tempfile.NamedTemporaryFile('w', suffix='.txt',
+                                                delete=False)
+        self.file.write('PPPPLT19A01B836X - 01/01/2019 TSH 3.15, FT4 n\n'
+                        'pppplt19a01b836x - 01/02/2019 TSH 2.8, XYZ 1\n'
+                        '\n'
+                        'ZZZZZZ19A01B836X - 01/03/2019 TSH 1.1\n'
+                        'PPPPLT19A01B836X - 01/04/2019 TSH\n'
+                        'PPPPLT19A01B836X - 41/04/2019 TSH 1\n')
+        self.file.close()
+
+    def tearDown(self):
+        os.remove(self.file.name)
+
+    def import_reports(self, **options):
+        out = io.StringIO()
+        call_command('import_lab_reports', self.file.name, stdout=out,
+                     **options)
+        return out.getvalue()
+
+    def test_import_in_process(self):
+        out = self.import_reports(workers=0, chunk_size=2)
+        self.assertEqual(Analysis.objects.count(), 3)
+        self.assertIn('5 lines', out)
+        self.assertIn('3 rejected lines', out)
+        self.assertIn('1 skipped analytes', out)
+
+    def test_parser_errors_reject_their_line(self):
+        parse = TextToAnalysisTranslator.parse
+
+        def broken_parse(translator, text):
+            if '01/02/2019' in text:
+                raise IndexError('broken')
+            return parse(translator, text)
+
+        err = io.StringIO()
+        with mock.patch.object(TextToAnalysisTranslator, 'parse',
+                               broken_parse):
+            out = self.import_reports(workers=0, verbosity=2, stderr=err)
+        self.assertIn('4 rejected lines', out)
+        self.assertIn('line 2: IndexError: broken', err.getvalue())
+        self.assertEqual(Analysis.objects.count(), 2)
+
+    def test_import_with_process_pool(self):
+        self.import_reports(workers=2, chunk_size=1)
+        self.assertEqual(Analysis.objects.count(), 3)
+
+    def test_import_with_spawned_workers(self):
+        # the workers import the command, and the models, from scratch
+        self.import_reports(workers=1, chunk_size=2, start_method='spawn')
+        self.assertEqual(Analysis.objects.count(), 3)
+
+
+class ItalianPeriodDateFieldTestCase(TestCase):
+
+    DATES = ['25/2/2019', '2018', '3/11/2018', '11/2018', '1/1/2000',
+             '12/2018', '71']
+
+    def setUp(self):
+        self.patient = Patient.objects.create(
+                last_name='pippo', first_name='plutoso', sex='m',
+                birth_date='2019-01-01', birth_place='carvico')
+        for date in self.DATES:
+            BMD.objects.create(patient=self.patient, date=date)
+
+    def test_key(self):
+        self.assertEqual(ItalianPeriodDate.fromstring('3/11/2018').key,
+                         '20181103d')
+        self.assertEqual(ItalianPeriodDate.fromstring('11/2018').key,
+                         '20181100m')
+        self.assertEqual(ItalianPeriodDate.fromstring('71').key, '19710000y')
+        date = ItalianPeriodDate.fromstring('28/11/1971')
+        self.assertEqual(ItalianPeriodDate.fromkey(date.key), date)
+
+    def test_stored_as_key(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT date FROM patients_bmd ORDER BY date')
+            keys = [row[0] for row in cursor.fetchall()]
+        self.assertEqual(keys[0], '19710000y')
+        self.assertEqual(keys[-1], '20190225d')
+
+    def test_order_by_date(self):
+        dates = [str(b.date) for b in BMD.objects.order_by('date')]
+        self.assertEqual(dates, ['1971', '1/1/2000', '2018', '11/2018',
+                                 '3/11/2018', '12/2018', '25/2/2019'])
+
+    def test_filter_by_date(self):
+        self.assertEqual(BMD.objects.filter(date='11/2018').count(), 1)
+        self.assertEqual(BMD.objects.filter(date__in=['71', '2018']).count(),
+                         2)
+
+    def test_period_lookups(self):
+        count = lambda **lookup: BMD.objects.filter(**lookup).count()
+        self.assertEqual(count(date__within='2018'), 4)
+        self.assertEqual(count(date__within='11/2018'), 2)
+        self.assertEqual(count(date__compatible='11/2018'), 3)
+        self.assertEqual(count(date__compatible='3/11/2018'), 3)
+        self.assertEqual(count(date__lt='11/2018'), 2)
+        self.assertEqual(count(date__lte='11/2018'), 3)
+        self.assertEqual(count(date__gt='2018'), 1)
+        self.assertEqual(count(date__gte='11/2018'), 3)
+
+    def test_period_lookups_match_operators(self):
+        def python_filter(operator, period):
+            dates = set()
+            for bmd in BMD.objects.all():
+                try:
+                    if operator(bmd.date, period):
+                        dates.add(str(bmd.date))
+                except TypeError:
+                    pass
+            return dates
+
+        operators = {'lt': lambda a, b: a < b, 'lte': lambda a, b: a <= b,
+                     'gt': lambda a, b: a > b, 'gte': lambda a, b: a >= b,
+                     'compatible': lambda a, b: a @ b}
+        for date in self.DATES + ['2019', '28/11/1971', '2/2000']:
+            period = ItalianPeriodDate.fromstring(date)
+            for lookup, operator in operators.items():
+                filtered = BMD.objects.filter(**{'date__' + lookup: date})
+                self.assertEqual({str(b.date) for b in filtered},
+                                 python_filter(operator, period),
+                                 (lookup, date))
+
+
+class ItalianPeriodDateTestCase(TestCase):
+
+    def test_validation(self):
+        for args in [(5,), (123,), (-1,), (2018, 13), (2018, None, 2),
+                     (2018, 2, 30)]:
+            with self.assertRaises(ValueError, msg=args):
+                ItalianPeriodDate(*args)
+        self.assertEqual(str(ItalianPeriodDate(71, 11, 28)), '28/11/1971')
+        self.assertEqual(str(ItalianPeriodDate(18, 0, 3)), '2018')
+
+    def test_immutable_and_hashable(self):
+        date = ItalianPeriodDate(2018, 11)
+        with self.assertRaises(AttributeError):
+            date._month = 12
+        with self.assertRaises(AttributeError):
+            date.other = 1
+        self.assertEqual(len({date, ItalianPeriodDate(2018, 11),
+                              ItalianPeriodDate(2018)}), 2)
+        self.assertEqual(pickle.loads(pickle.dumps(date)), date)
+
+    def test_cached_instances(self):
+        self.assertIs(ItalianPeriodDate.fromstring('3/11/2018'),
+                      ItalianPeriodDate.fromstring('3/11/2018'))
+        self.assertIs(ItalianPeriodDate.fromkey('20181103d'),
+                      ItalianPeriodDate.fromkey('20181103d'))
+
+
+class SeriesTestCase(TestCase):
+
+    def setUp(self):
+        self.patient = Patient.objects.create(
+                last_name='pippo', first_name='plutoso', sex='m',
+                birth_date='2019-01-01', birth_place='carvico')
+        AnalysisName.objects.create(name='tireotropina', short_name='TSH')
+        AnalysisName.objects.create(name='levotiroxina libera', short_name='FT4')
+        AnalysisName.objects.create(name='testosterone', short_name='testo')
+        Analysis.objects.lines_to_analysis(
+            '- 3/2019 TSH 2.1 (0.4-4.0), FT4 1.1, testo 5\n'
+            '- 1/1/2018 TSH 5.5 (0.4-4.0)\n'
+            '- 2017 TSH n\n', self.patient)
+
+    def test_series(self):
+        with self.assertNumQueries(1):
+            series = Analysis.objects.series(self.patient, ['TSH', 'FT4'])
+        self.assertEqual(set(series), {'TSH', 'FT4'})
+        tsh = series['TSH']
+        self.assertEqual(tsh['dates'], ['2017', '1/1/2018', '3/2019'])
+        self.assertEqual(tsh['keys'], sorted(tsh['keys']))
+        self.assertEqual(tsh['values'], [None, 5.5, 2.1])
+        self.assertEqual(tsh['ratings'], ['n', 'a', 'n'])
+        self.assertEqual(series['FT4']['upper_limits'], [None])
+
+    def test_series_view(self):
+        url = reverse('patients:patient_series', args=[self.patient.pk])
+        response = self.client.get(url, {'analyte': 'testo'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['series']['testo']['values'], [5.0])
+        response = self.client.get(url)
+        self.assertEqual(len(response.json()['series']), 3)
+        url = reverse('patients:patient_series', args=[self.patient.pk + 1])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class PatientsListTestCase(TestCase):
+
+    def setUp(self):
+        Patient.objects.bulk_create([
+            Patient(last_name=f'rossi{i:02d}', first_name='mario', sex='m',
+                    birth_date='1971-11-28', birth_place='bergamo',
+                    fiscal_code=f'RSSMRA71S28A794{i:02d}')
+            for i in range(PatientsListView.page_size + 5)])
+        Patient.objects.create(last_name='bianchi', first_name='anna',
+                               sex='f', birth_date='1980-01-01',
+                               birth_place='lecco')
+        self.url = reverse('patients:patients_list')
+
+    def test_keyset_pages(self):
+        response = self.client.get(self.url)
+        page = response.context['patient_list']
+        self.assertEqual(len(page), PatientsListView.page_size)
+        self.assertEqual(page[0].last_name, 'bianchi')
+        cursor = response.context['next_cursor']
+        self.assertIsNotNone(cursor)
+        response = self.client.get(self.url, {'after': cursor})
+        page = response.context['patient_list']
+        self.assertEqual([p.last_name for p in page],
+                         [f'rossi{i:02d}' for i in range(49, 55)])
+        self.assertIsNone(response.context['next_cursor'])
+
+    def test_search(self):
+        response = self.client.get(self.url, {'q': 'Rossi0 mar'})
+        self.assertEqual(len(response.context['patient_list']), 10)
+        response = self.client.get(self.url, {'q': 'rssmra71s28a79410'})
+        self.assertEqual([p.last_name for p in response.context['patient_list']],
+                         ['rossi10'])
+        response = self.client.get(self.url, {'q': 'bianchi x'})
+        self.assertEqual(len(response.context['patient_list']), 0)
+
+    def test_invalid_cursor(self):
+        first_page = self.client.get(self.url).context['patient_list']
+        for cursor in ('not a cursor', encode_cursor(('a', 'b', 'x')),
+                       encode_cursor((None, None, None)),
+                       encode_cursor(('a', 'b')),
+                       encode_cursor(('a', 'b', True)),
+                       base64.urlsafe_b64encode(b'{"a": 1}').decode()):
+            response = self.client.get(self.url, {'after': cursor})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(list(response.context['patient_list']),
+                             list(first_page))
+
+
+class PatientSearchTestCase(TestCase):
+
+    def setUp(self):
+        self.rossi = Patient.objects.create(
+            last_name='rossi', first_name='mario', sex='m',
+            birth_date='1971-11-28', birth_place='bergamo',
+            fiscal_code='RSSMRA71S28A794X')
+        Patient.objects.create(last_name='rossini', first_name='maria',
+                               sex='f', birth_date='1980-05-02',
+                               birth_place='lecco')
+        Patient.objects.create(last_name='bianchi', first_name='mario',
+                               sex='m', birth_date='1971-01-01',
+                               birth_place='carvico')
+
+    def search(self, text):
+        return [p.last_name for p in patient_search_index.search(text)]
+
+    def test_search(self):
+        self.assertEqual(self.search('ross mar 1971'), ['rossi'])
+        self.assertEqual(sorted(self.search('ross')), ['rossi', 'rossini'])
+        self.assertEqual(self.search('RSSMRA71'), ['rossi'])
+        self.assertEqual(self.search('mario carv'), ['bianchi'])
+        self.assertEqual(self.search(' '), [])
+
+    def test_signals_update_index(self):
+        self.rossi.last_name = 'verdi'
+        self.rossi.save()
+        self.assertEqual(self.search('ross'), ['rossini'])
+        self.assertEqual(self.search('verdi'), ['verdi'])
+        self.rossi.delete()
+        self.assertEqual(self.search('verdi'), [])
+
+    def test_rebuild(self):
+        Patient.objects.bulk_create([Patient(
+            last_name='neri', first_name='luca', sex='m',
+            birth_date='1990-01-01', birth_place='milano')])
+        self.assertEqual(self.search('neri'), [])
+        call_command('rebuild_patient_search', stdout=io.StringIO())
+        self.assertEqual(self.search('neri'), ['neri'])
+
+    def test_failed_rebuild_keeps_the_table(self):
+        with mock.patch.object(patient_search_index, '_insert',
+                               side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                patient_search_index.rebuild()
+        self.assertEqual(sorted(self.search('ross')), ['rossi', 'rossini'])
+
+    def test_search_view(self):
+        response = self.client.get(reverse('patients:patient_search'),
+                                   {'q': 'ross mar 1971'})
+        results = response.json()['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['id'], self.rossi.pk)
+
+
+class PatientDetailTestCase(TestCase):
+
+    def setUp(self):
+        self.place = Place.objects.create(municipality='carvico')
+        self.codes = [ExemptionCodes.objects.create(
+            code=f'0{i}', name=f'malattia {i}', short_name=f'm{i}')
+            for i in range(5)]
+        AnalysisName.objects.create(name='tireotropina', short_name='TSH')
+
+    def make_patient(self, items: int):
+        patient = Patient.objects.create(
+            last_name='pippo', first_name='plutoso', sex='m',
+            birth_date='2019-01-01', birth_place='carvico')
+        for code in self.codes[:items]:
+            Exemption.objects.create(patient=patient, exemption=code,
+                                     signature_place=self.place)
+            BMD.objects.create(patient=patient, ls_t=-1.5)
+        Analysis.objects.lines_to_analysis(
+            [f'- {i + 1}/1/2019 TSH {i}.5' for i in range(items)], patient)
+        return patient
+
+    def test_constant_queries(self):
+        for items in (1, 5):
+            patient = self.make_patient(items)
+            url = reverse('patients:patient_detail', args=[patient.pk])
+            self.client.get(url)  # loads the reference tables
+            # patient and 3 prefetches, the choices come from the cache
+            with self.assertNumQueries(4):
+                response = self.client.get(url)
+            self.assertEqual(len(response.context['exemptions']), items)
+            self.assertEqual(len(response.context['analyses']), items)
+            self.assertContains(response, 'malattia', count=0)
+            self.assertContains(response, '(m0)', count=2)
+
+    def test_unrated_analysis(self):
+        patient = self.make_patient(0)
+        Analysis.objects.text_to_analysis('- 01/01/2019 TSH 0', patient)
+        self.assertIsNone(Analysis.objects.get().computed_rating)
+        response = self.client.get(
+            reverse('patients:patient_detail', args=[patient.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'TSH')
+        self.assertIn('TSH', str(Analysis.objects.get()))
+
+    def test_rapid_form_is_bound_to_patient(self):
+        patient = self.make_patient(0)
+        form = RapidExemptionForm(patient=patient)
+        self.assertEqual(list(form.fields['patient'].queryset), [patient])
+        self.assertIn(f'value="{patient.pk}"', str(form['patient']))
+
+
+@override_settings(PDF_CACHE='pdf', CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'pdf': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'pdf-tests'}})
+class ExemptionPDFTestCase(TestCase):
+
+    def setUp(self):
+        patient = Patient.objects.create(
+            last_name='pippo', first_name='plutoso', sex='m',
+            birth_date='2019-01-01', birth_place='carvico')
+        code = ExemptionCodes.objects.create(code='035', name='ipotiroidismo',
+                                             short_name='ipot')
+        self.exemption = Exemption(patient=patient, exemption=code,
+                                   signature_place=Place.objects.create(
+                                       municipality='carvico'))
+        self.exemption.full_clean()
+        self.exemption.save()
+        self.url = reverse('patients:exemption_pdf', args=[self.exemption.pk])
+        caches['pdf'].clear()
+
+    def test_pdf_is_cached(self):
+        with mock.patch.object(PDFResponseView, 'make_pdf', autospec=True,
+                               side_effect=PDFResponseView.make_pdf) \
+                as make_pdf:
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.content.startswith(b'%PDF'))
+            again = self.client.get(self.url)
+        self.assertEqual(make_pdf.call_count, 1)
+        self.assertEqual(again.content, response.content)
+        self.assertEqual(again['ETag'], response['ETag'])
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.exemption.signature_date = datetime.date(2019, 3, 1)
+        self.exemption.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class ExemptionBatchPDFTestCase(TestCase):
+
+    def setUp(self):
+        code = ExemptionCodes.objects.create(code='035', name='ipotiroidismo',
+                                             short_name='ipot')
+        self.place = Place.objects.create(municipality='carvico')
+        other = Place.objects.create(municipality='calusco')
+        for n, (place, day) in enumerate([(self.place, 1), (self.place, 1),
+                                          (other, 1), (self.place, 2)]):
+            patient = Patient.objects.create(
+                last_name=f'pippo{n}', first_name='plutoso', sex='m',
+                birth_date='2019-01-01', birth_place='carvico')
+            exemption = Exemption(patient=patient, exemption=code,
+                                  signature_place=place,
+                                  signature_date=datetime.date(2019, 3, day))
+            exemption.full_clean()
+            exemption.save()
+        self.url = reverse('patients:exemption_pdf_batch')
+
+    def count_pages(self, pdf: bytes) -> int:
+        return len(re.findall(rb'/Type /Page\b(?!s)', pdf))
+
+    def test_one_page_per_exemption(self):
+        response = self.client.get(self.url, {
+            'date_from': '2019-03-01', 'date_to': '2019-03-01',
+            'place': self.place.pk, 'code': '035'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        pdf = b''.join(response.streaming_content)
+        self.assertTrue(pdf.startswith(b'%PDF'))
+        self.assertEqual(self.count_pages(pdf), 2)
+        self.assertIn('esenzioni.pdf', response['Content-Disposition'])
+
+    def test_bad_or_empty_filter(self):
+        response = self.client.get(self.url, {'date_from': 'ieri'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(self.url, {'code': '999'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'esenzioni.pdf')
+            out = io.StringIO()
+            call_command('print_exemptions', path, '--from', '2019-03-01',
+                         stdout=out)
+            with open(path, 'rb') as file:
+                self.assertEqual(self.count_pages(file.read()), 4)
+        self.assertIn('4 certificates', out.getvalue())
+
+
+class PDFGeneratorViewTestCase(TestCase):
+
+    data = {'name': 'PIPPO PLUTOSO', 'birth_place': 'Carvico',
+            'birth_date': '01/01/2019', 'exemption_name': 'Ipotiroidismo',
+            'exemption_code': '035', 'place': 'Carvico', 'date': '01/03/2019'}
+
+    def test_base_view_streams_a_named_attachment(self):
+        response = self.client.get(reverse('patients:test_pdf'))
+        self.assertTrue(response.streaming)
+        self.assertTrue(b''.join(response.streaming_content)
+                        .startswith(b'%PDF'))
+        self.assertIn('filename="doc.pdf"', response['Content-Disposition'])
+
+    @mock.patch('reportlab.rl_config.invariant', 1)
+    def test_fragments_render_like_fresh_flowables(self):
+        view = PDFResponseView()
+        for fragment in certificates.FRAGMENTS:
+            fragment.clear()
+        fresh = view.make_pdf(self.data)
+        self.assertEqual(view.make_pdf(self.data), fresh)
+        self.assertEqual(view.make_pdf(self.data), fresh)
+        other = view.make_pdf(dict(self.data, name='ROSSI MARIO'))
+        self.assertNotEqual(other, fresh)
+
+    def test_bench_pdf_reports_every_scenario(self):
+        out = io.StringIO()
+        call_command('bench_pdf', count=1, stdout=out)
+        self.assertEqual([line.split()[0] for line in
+                          out.getvalue().splitlines()],
+                         ['legacy', 'cold', 'warm', 'batch'])
+
+
+class PDFJobTestCase(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_settings = self.settings(MEDIA_ROOT=self.media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        code = ExemptionCodes.objects.create(code='035', name='ipotiroidismo',
+                                             short_name='ipot')
+        place = Place.objects.create(municipality='carvico')
+        for n in range(3):
+            patient = Patient.objects.create(
+                last_name=f'pippo{n}', first_name='plutoso', sex='m',
+                birth_date='2019-01-01', birth_place='carvico')
+            exemption = Exemption(patient=patient, exemption=code,
+                                  signature_place=place,
+                                  signature_date=datetime.date(2019, 3, 1))
+            exemption.full_clean()
+            exemption.save()
+
+    def enqueue(self, **params):
+        return self.client.post(
+            reverse('patients:pdf_job_create', args=['exemptions']), params)
+
+    def test_enqueue_render_download(self):
+        response = self.enqueue(date_from='2019-03-01', code='035')
+        self.assertEqual(response.status_code, 202)
+        status_url = response['Location']
+        self.assertEqual(self.client.get(status_url).json()['status'],
+                         PDFJob.QUEUED)
+        out = io.StringIO()
+        call_command('run_pdf_workers', '--workers', '0', '--drain',
+                     stdout=out)
+        self.assertIn('1 jobs rendered', out.getvalue())
+        status = self.client.get(status_url).json()
+        self.assertEqual(status['status'], PDFJob.DONE)
+        self.assertEqual(status['pages'], 3)
+        response = self.client.get(status['download_url'])
+        self.assertTrue(b''.join(response.streaming_content)
+                        .startswith(b'%PDF'))
+        response.close()
+
+    def test_invalid_and_failed_jobs(self):
+        response = self.enqueue(date_from='ieri')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date_from', response.json()['errors'])
+        self.assertEqual(self.client.post(reverse(
+            'patients:pdf_job_create', args=['nothing'])).status_code, 404)
+        status_url = self.enqueue(code='999')['Location']
+        call_command('run_pdf_workers', '--workers', '0', '--drain',
+                     stdout=io.StringIO())
+        status = self.client.get(status_url).json()
+        self.assertEqual(status['status'], PDFJob.FAILED)
+        self.assertIn('No document', status['error'])
+        self.assertNotIn('download_url', status)
+
+    def test_a_job_is_claimed_once(self):
+        self.enqueue(code='035')
+        job = pdf_job_queue.claim()
+        self.assertEqual(job.status, PDFJob.RUNNING)
+        self.assertIsNone(pdf_job_queue.claim())
+        PDFJob.objects.filter(pk=job.pk).update(
+            started=job.started - datetime.timedelta(hours=2))
+        self.assertEqual(pdf_job_queue.requeue_stale(60), 1)
+        self.assertEqual(pdf_job_queue.claim().pk, job.pk)
+
+
+class BenchTestCase(TestCase):
+
+    def generated(self, seed: int) -> list:
+        dataset = bench.generate(seed=seed, patients=4, analyses=5)
+        rows = list(Analysis.objects.order_by('pk').values_list(
+            'patient__last_name', 'name__short_name', 'date', 'value'))
+        for model in (Patient, AnalysisName, ExemptionCodes, Place):
+            model.objects.all().delete()
+        dataset.user.delete()
+        return rows
+
+    def test_generate_is_reproducible(self):
+        rows = self.generated(seed=3)
+        self.assertEqual(len(rows), 20)
+        self.assertEqual(self.generated(seed=3), rows)
+        self.assertNotEqual(self.generated(seed=4), rows)
+
+    def test_run_and_compare(self):
+        dataset = bench.generate(patients=3, analyses=4)
+        results = bench.run(bench.Bench(dataset), repeat=1, warmup=0)
+        self.assertEqual(set(results), set(bench.SCENARIOS))
+        self.assertEqual(results['patient_detail']['runs'], 1)
+        old = bench.report(results)
+        new = {'scenarios': {name: dict(result, median=result['median'] * 2)
+                             for name, result in results.items()}}
+        comparison = bench.compare(old, new, threshold=0.5)
+        self.assertEqual(comparison['ingest']['status'], 'regression')
+        self.assertEqual(bench.compare(new, old)['ingest']['status'],
+                         'improvement')
+        self.assertEqual(bench.compare(old, old)['ingest']['status'], 'ok')
+
+
+class PerformanceMiddlewareTestCase(TestCase):
+
+    def setUp(self):
+        perf_stats.clear()
+        self.patient = Patient.objects.create(
+            last_name='pippo', first_name='plutoso', sex='m',
+            birth_date='2019-01-01', birth_place='carvico')
+        self.staff = User.objects.create_user('staff', password='secret',
+                                              is_staff=True)
+
+    def test_server_timing_and_stats(self):
+        url = reverse('patients:patient_detail', args=[self.patient.pk])
+        for _ in range(3):
+            response = self.client.get(url)
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('tpl;dur=', timing)
+        stats = perf_stats.summary()['patients:patient_detail']
+        self.assertEqual(stats['count'], 3)
+        self.assertGreater(stats['queries']['p50'], 0)
+        self.assertGreater(stats['template']['max'], 0)
+
+    def test_stats_view_is_staff_only(self):
+        self.client.get(reverse('patients:patients_list'))
+        url = reverse('patients:perf_stats')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.staff)
+        url_names = self.client.get(url).json()['url_names']
+        self.assertEqual(url_names['patients:patients_list']['count'], 1)
+
+    def test_snapshots_are_merged_by_the_command(self):
+        self.client.get(reverse('patients:patients_list'))
+        with tempfile.TemporaryDirectory() as directory:
+            perf_stats.snapshot(directory)
+            out = io.StringIO()
+            call_command('perf_stats', '--dir', directory, '--json',
+                         stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['processes'], 1)
+        self.assertEqual(
+            report['url_names']['patients:patients_list']['count'], 1)
+
+
+class ProfilingTestCase(TestCase):
+
+    def setUp(self):
+        self.profiles = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profiles.cleanup)
+        profile_settings = self.settings(PROFILE_DIR=self.profiles.name,
+                                         PROFILE_KEEP=2)
+        profile_settings.enable()
+        self.addCleanup(profile_settings.disable)
+        self.patient = Patient.objects.create(
+            last_name='pippo', first_name='plutoso', sex='m',
+            birth_date='2019-01-01', birth_place='carvico')
+        AnalysisName.objects.create(name='tireotropina', short_name='TSH')
+
+    def saved(self) -> list:
+        return [load_meta(self.profiles.name, profile_id)
+                for profile_id in profile_ids(self.profiles.name)]
+
+    def test_hooks_are_off_by_default(self):
+        Analysis.objects.text_to_analysis('- 01/01/2019 TSH 1', self.patient)
+        self.assertEqual(self.saved(), [])
+
+    def test_hooks_fill_a_bounded_ring(self):
+        with self.settings(PROFILE_HOOKS=True):
+            for day in (1, 2, 3):
+                Analysis.objects.text_to_analysis(f'- {day}/01/2019 TSH 1',
+                                                  self.patient)
+        saved = self.saved()
+        self.assertEqual(len(saved), 2)
+        self.assertEqual({meta['name'] for meta in saved},
+                         {'AnalysisManager.text_to_analysis'})
+        out = io.StringIO()
+        call_command('profiles', '--dir', self.profiles.name, '--top', '5',
+                     stdout=out)
+        self.assertIn('2 profiles', out.getvalue())
+
+    def test_ingest_hooks_count_the_parsed_lines(self):
+        lines = [f'- {day}/01/2019 TSH 1' for day in (1, 2, 3)]
+        with self.settings(PROFILE_HOOKS=True):
+            Analysis.objects.lines_to_analysis(lines, self.patient)
+        meta, = self.saved()
+        self.assertEqual(meta['name'], 'AnalysisManager.lines_to_analysis')
+        calls, _ = meta['counters']['TextToAnalysisTranslator.parse']
+        self.assertEqual(calls, 3)
+
+    def test_import_lab_reports_hooks(self):
+        self.patient.fiscal_code = 'PPPPLT19A01B836X'
+        self.patient.save()
+        reports = tempfile.NamedTemporaryFile('w', suffix='.txt',
+                                              delete=False)
+        self.addCleanup(os.remove, reports.name)
+        with reports:
+            reports.write('PPPPLT19A01B836X - 01/01/2019 TSH 3.15\n'
+                          'PPPPLT19A01B836X - 01/02/2019 TSH 2.8\n')
+        with self.settings(PROFILE_HOOKS=True, PROFILE_KEEP=10):
+            call_command('import_lab_reports', reports.name, workers=0,
+                         stdout=io.StringIO())
+        saved = {meta['name']: meta for meta in self.saved()}
+        self.assertEqual(set(saved), {'import_lab_reports.parse_chunk',
+                                      'import_lab_reports.save_chunk'})
+        calls, _ = saved['import_lab_reports.parse_chunk']['counters'][
+            'TextToAnalysisTranslator.parse']
+        self.assertEqual(calls, 2)
+
+    def test_staff_header_profiles_the_request(self):
+        Analysis.objects.text_to_analysis('- 01/01/2019 TSH 1', self.patient)
+        url = reverse('patients:patient_detail', args=[self.patient.pk])
+        response = self.client.get(url, HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Id', response)
+        self.client.force_login(User.objects.create_user(
+            'staff', password='secret', is_staff=True))
+        response = self.client.get(url, HTTP_X_PROFILE='1')
+        meta = load_meta(self.profiles.name, response['X-Profile-Id'])
+        self.assertEqual(meta['name'], 'request patients:patient_detail')
+        calls, _ = meta['counters']['ItalianPeriodDateField.from_db_value']
+        self.assertEqual(calls, 1)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite')
+class QueryPlanTestCase(TestCase):
+
+    def test_hot_queries_use_indexes(self):
+        for name, query in queryplans.HOT_QUERIES.items():
+            with self.subTest(name):
+                queryset = query()
+                self.assertEqual(queryplans.table_scans(queryset), [],
+                                 queryplans.explain(queryset))
+
+    def test_table_scans_are_detected(self):
+        queryset = Analysis.objects.filter(unit='ng/ml')
+        self.assertEqual(queryplans.table_scans(queryset),
+                         ['patients_analysis'])
+
+
+class DatabaseProfileTestCase(TestCase):
+
+    @override_settings(SQLITE_PRAGMAS={'cache_size': -1234})
+    def test_sqlite_pragmas(self):
+        apply_sqlite_pragmas(connection)
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -1234)
+        with self.settings(SQLITE_PRAGMAS={'cache_size': '1; DROP'}):
+            with self.assertRaises(ValueError):
+                apply_sqlite_pragmas(connection)
+
+    def make_replica(self, *models):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.databases['replica'] = dict(
+            connections.databases['default'],
+            NAME=os.path.join(directory.name, 'replica.sqlite3'))
+        self.addCleanup(self.drop_replica)
+        with connections['replica'].schema_editor() as editor:
+            for model in models:
+                editor.create_model(model)
+
+    def test_read_only_views_read_from_the_replica(self):
+        self.make_replica(Patient)
+        Patient.objects.create(last_name='primario', first_name='a', sex='m',
+                               birth_date='2019-01-01', birth_place='x')
+        Patient.objects.using('replica').create(
+            last_name='replica', first_name='b', sex='f',
+            birth_date='2019-01-01', birth_place='x')
+        response = self.client.get(reverse('patients:patients_list'))
+        self.assertEqual([p.last_name for p in response.context['patient_list']],
+                         ['replica'])
+        self.assertEqual([p.last_name for p in Patient.objects.all()],
+                         ['primario'])
+        with use_replica():
+            self.assertEqual(Patient.objects.get().last_name, 'replica')
+            self.assertEqual(
+                ReplicaRouter().db_for_write(Patient), 'default')
+
+    @override_settings(PDF_CACHE='pdf', CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'pdf': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'pdf-tests'}})
+    def test_pages_after_a_write_read_from_default(self):
+        # an empty replica, as before the next refresh_replica
+        self.make_replica(Patient, ExemptionCodes, Place, Exemption,
+                          AnalysisName, Analysis, BMD)
+        patient = Patient.objects.create(
+            last_name='pippo', first_name='plutoso', sex='m',
+            birth_date='2019-01-01', birth_place='carvico')
+        code = ExemptionCodes.objects.create(code='027', name='ipotiroidismo',
+                                             short_name='ipot')
+        place = Place.objects.create(municipality='carvico')
+        response = self.client.post(reverse('patients:rapid_add_exemption'), {
+            'patient': patient.pk, 'exemption': code.pk,
+            'signature_place': place.pk, 'signature_date': '2019-03-01'},
+            follow=True)
+        self.assertEqual(response.status_code, 200)
+        exemption, = response.context['exemptions']
+        response = self.client.get(reverse('patients:exemption_pdf',
+                                           args=[exemption.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(
+            reverse('patients:patient_series', args=[patient.pk]),
+        ).status_code, 200)
+
+    def drop_replica(self):
+        connections['replica'].close()
+        del connections.databases['replica']
+        delattr(connections._connections, 'replica')
+
+
+class ReferenceTableTestCase(TestCase):
+
+    def setUp(self):
+        for table in REFERENCE_TABLES.values():
+            table.invalidate()
+        self.place = Place.objects.create(municipality='carvico')
+        self.code = ExemptionCodes.objects.create(
+            code='027', name='ipotiroidismo', short_name='ipot')
+        self.patient = Patient.objects.create(
+            last_name='pippo', first_name='plutoso', sex='m',
+            birth_date='2019-01-01', birth_place='carvico')
+
+    def test_steady_state_costs_no_query(self):
+        self.assertEqual(places.all(), [self.place])
+        with self.assertNumQueries(0):
+            self.assertEqual(places.all(), [self.place])
+            self.assertEqual(places.get(self.place.pk), self.place)
+            self.assertIsNone(places.get(self.place.pk + 1))
+
+    def test_invalidated_on_save_and_delete(self):
+        places.all()
+        other = Place.objects.create(municipality='calusco')
+        self.assertEqual(places.all(), [self.place, other])
+        other.municipality = 'bergamo'
+        other.save()
+        self.assertEqual(places.get(other.pk).municipality, 'bergamo')
+        other.delete()
+        self.assertEqual(places.all(), [self.place])
+
+    def test_invalidated_again_on_commit(self):
+        with mock.patch('patients.signals.transaction.on_commit') as on_commit:
+            Place.objects.create(municipality='calusco')
+        on_commit.assert_called_once_with(places.invalidate, using='default')
+
+    def test_shared_cache_is_read_by_other_processes(self):
+        places.all()
+        places._local = (None, {})  # a fresh process, same cache
+        with self.assertNumQueries(0):
+            self.assertEqual(places.all(), [self.place])
+
+    def test_form_renders_and_validates_from_cache(self):
+        RapidExemptionForm(patient=self.patient).as_p()
+        with self.assertNumQueries(0):
+            html = RapidExemptionForm(patient=self.patient).as_p()
+        self.assertIn('carvico', html)
+        self.assertIn('ipot', html)
+        form = RapidExemptionForm({
+            'patient': self.patient.pk, 'exemption': self.code.pk,
+            'signature_place': self.place.pk,
+            'signature_date': '2019-03-01'}, patient=self.patient)
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['signature_place'], self.place)
+        self.assertEqual(form.cleaned_data['exemption'], self.code)
+
+    def test_invalid_choice(self):
+        for value in (self.place.pk + 1, 'carvico'):
+            form = ExemptionBatchForm({'place': value})
+            self.assertFalse(form.is_valid())
+            self.assertEqual(form.errors['place'][0],
+                             ExemptionBatchForm.base_fields['place']
+                             .error_messages['invalid_choice'])
+        form = ExemptionBatchForm({'place': self.place.pk})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['place'], self.place)
+
+    def test_admin_form_fields(self):
+        self.client.force_login(User.objects.create_superuser(
+            'admin', 'admin@example.com', 'admin'))
+        response = self.client.get(
+            reverse('patients_admin:patients_exemption_add'))
+        fields = response.context['adminform'].form.fields
+        for name in ('exemption', 'signature_place'):
+            self.assertIsInstance(fields[name], ReferenceChoiceField)
+        self.assertNotIsInstance(fields['patient'], ReferenceChoiceField)
+        self.assertContains(response, 'carvico')
+
+
+class UpgradeTestCase(TestCase):
+    # the patients tables of a database made by the old migrations
+    LEGACY_SCHEMA = (
+        'CREATE TABLE "patients_patient" ("id" integer NOT NULL PRIMARY KEY '
+        'AUTOINCREMENT, "last_name" varchar(50) NOT NULL, "first_name" '
+        'varchar(50) NOT NULL, "address" varchar(200) NULL, "birth_date" '
+        'date NOT NULL, "fiscal_code" varchar(16) NULL, "sex" varchar(1) '
+        'NOT NULL, "birth_place" varchar(100) NOT NULL)',
+        'CREATE TABLE "patients_analysisname" ("id" integer NOT NULL PRIMARY '
+        'KEY AUTOINCREMENT, "name" varchar(100) NOT NULL, "short_name" '
+        'varchar(25) NOT NULL)',
+        'CREATE TABLE "patients_analysis" ("id" integer NOT NULL PRIMARY KEY '
+        'AUTOINCREMENT, "name_id" integer NOT NULL REFERENCES '
+        '"patients_analysisname" ("id") DEFERRABLE INITIALLY DEFERRED, '
+        '"value" real NULL, "rate" varchar(2) NULL, "lower_limit" real NULL, '
+        '"upper_limit" real NULL, "unit" varchar(10) NULL, "patient_id" '
+        'integer NOT NULL REFERENCES "patients_patient" ("id") DEFERRABLE '
+        'INITIALLY DEFERRED, "date" varchar(10) NOT NULL)',
+        "INSERT INTO patients_patient VALUES "
+        "(1, 'pippo', 'plutoso', NULL, '2019-01-01', NULL, 'm', 'carvico')",
+        "INSERT INTO patients_analysisname VALUES (1, 'tireotropina', 'TSH')",
+        "INSERT INTO patients_analysis VALUES "
+        "(1, 1, 5.1, NULL, 0.4, 4.0, NULL, 1, '7/6/99'), "
+        "(2, 1, 2.0, NULL, 0.4, 4.0, NULL, 1, '12/12'), "
+        "(3, 1, 1.0, NULL, 0.4, 4.0, NULL, 1, '2018')",
+    )
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.databases['legacy'] = dict(
+            connections.databases['default'],
+            NAME=os.path.join(directory.name, 'legacy.sqlite3'))
+        self.addCleanup(self.drop_legacy)
+        with connections['legacy'].cursor() as cursor:
+            for statement in self.LEGACY_SCHEMA:
+                cursor.execute(statement)
+
+    def drop_legacy(self):
+        connections['legacy'].close()
+        del connections.databases['legacy']
+        delattr(connections._connections, 'legacy')
+
+    def test_upgrade(self):
+        out = io.StringIO()
+        call_command('upgrade_db', database='legacy', stdout=out)
+        self.assertIn('added column patients_analysis.computed_rating',
+                      out.getvalue())
+        self.assertIn('created table patients_pdfjob', out.getvalue())
+        self.assertIn('added index patient_name_idx', out.getvalue())
+        self.assertIn('rated 3 analyses', out.getvalue())
+        analysis = Analysis.objects.using('legacy').get(pk=1)
+        self.assertEqual(analysis.computed_rating, 'a')
+        self.assertEqual(PDFJob.objects.using('legacy').count(), 0)
+        with connections['legacy'].cursor() as cursor:
+            constraints = connections['legacy'].introspection \
+                .get_constraints(cursor, 'patients_analysis')
+        self.assertIn('analysis_patient_date_idx', constraints)
+        self.assertEqual(
+            PatientSearchIndex('legacy').search('plut'),
+            list(Patient.objects.using('legacy').all()))
+
+    def test_upgrade_twice_changes_nothing(self):
+        call_command('upgrade_db', database='legacy', stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('upgrade_db', database='legacy', stdout=out)
+        self.assertEqual(out.getvalue(), 'Database up to date.\n')
+
+    def raw_dates(self) -> list:
+        with connections['legacy'].cursor() as cursor:
+            cursor.execute('SELECT date FROM patients_analysis ORDER BY id')
+            return [row[0] for row in cursor.fetchall()]
 
+    def test_period_dates_to_keys_and_back(self):
+        call_command('upgrade_db', database='legacy', stdout=io.StringIO())
+        self.assertEqual(self.raw_dates(),
+                         ['19990607d', '20121200m', '20180000y'])
+        self.assertEqual(
+            [a.pk for a in Analysis.objects.using('legacy').order_by('date')],
+            [1, 2, 3])
+        out = io.StringIO()
+        call_command('upgrade_db', database='legacy',
+                     revert_period_dates=True, stdout=out)
+        self.assertEqual(out.getvalue(), '3 period dates reverted.\n')
+        self.assertEqual(self.raw_dates(), ['7/6/1999', '12/2012', '2018'])
 
+    def test_invalid_period_dates_are_left(self):
+        with connections['legacy'].cursor() as cursor:
+            cursor.execute("UPDATE patients_analysis SET date = '41/4/2019' "
+                           "WHERE id = 1")
+        out = io.StringIO()
+        call_command('upgrade_db', database='legacy', stdout=out)
+        self.assertIn('converted 2 period dates to keys', out.getvalue())
+        self.assertIn('left 1 invalid period dates', out.getvalue())
+        self.assertEqual(self.raw_dates(),
+                         ['41/4/2019', '20121200m', '20180000y'])
+        self.assertEqual(convert_period_dates('legacy'), (0, 1))
 
+    def test_to_key_and_from_key(self):
+        for value, key, back in (('7/6/99', '19990607d', '7/6/1999'),
+                                 ('12/12', '20121200m', '12/2012'),
+                                 ('01/01/2019', '20190101d', '1/1/2019'),
+                                 ('71', '19710000y', '1971')):
+            self.assertEqual(to_key(value), key)
+            self.assertEqual(from_key(key), back)
+            self.assertEqual(to_key(from_key(key)), key)
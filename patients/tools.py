@@ -1,151 +1,243 @@
-import datetime
+import base64
+import binascii
+import io
+import json
+import re
+import tempfile
+from bisect import bisect_left
+from collections import namedtuple
+from copy import copy
+from functools import lru_cache
 from django.core.exceptions import ValidationError
-from django.db.models import CharField
-from django.http import HttpResponse
+from django.db.models import CharField, Lookup, Q
+from django.http import FileResponse
 from django.views.generic.base import View
 from reportlab.lib.enums import TA_CENTER
 from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import ParagraphStyle
-from reportlab.lib.units import cm
-from reportlab.platypus import SimpleDocTemplate, Spacer, Paragraph
+from reportlab.lib.styles import ParagraphStyle, StyleSheet1
+from reportlab.platypus import SimpleDocTemplate, Paragraph
+
+from .profiling import profile_hook
 
 EMPTY_ANALYSIS_DATA = {'value': None, 'rate': None, 'lower_limit': None,
                            'upper_limit': None, 'name': None, 'unit': None}
 
+# optional '- ' bullet, then the date token
+_HEADER_RE = re.compile(r'[\s.]*(?:-[-\s]*)?(\S+)\s+')
+# 'analyte first [second [third]] ...' up to and including its comma
+_ANALYSIS_RE = re.compile(r'[\s.]*([^\s,]+)\s+([^\s,]+)(?:\s+([^\s,]+))?'
+                          r'(?:\s+([^\s,]+))?[^,]*(?:,|\Z)')
+
+
+class AnalysisData(namedtuple('AnalysisData', tuple(EMPTY_ANALYSIS_DATA))):
+    """Compact record of one analysis parsed from text."""
+    __slots__ = ()
+
+    def as_dict(self) -> dict:
+        return dict(zip(self._fields, self))
+
+
+@lru_cache(maxsize=1024)
+def _process_range(text: str) -> tuple:
+    """'(<high)', '(>low)' or '(low-high)' to (low, high)."""
+    text = text.strip('()')
+    if text.startswith('<'):
+        return None, float(text[1:])
+    if text.startswith('>'):
+        return float(text[1:]), None
+    low, high = text.split('-')
+    return float(low), float(high)
+
 
-class TextToAnalysisTranslator: # TODO: ugly class!
+class TextToAnalysisTranslator:
+    """Translate '- dd/mm/yyyy analyte value [unit] [(range)], ...' text.
+
+    The text is lowered once and walked a single time by a precompiled
+    regular expression that yields the tokens of every analysis.
+    """
 
     def text_to_analysis(self, text: str) -> tuple:
-        # clean the string
-        text = self.clean_text(text)
-        # separate date an the analyses (rest of the string)
-        date, analyses = self.separate_date_and_analyses(text)
-        # separate the analysis tokens
-        analysis_tokens = self.separate_analyses(analyses)
-        # get analyses data
-        analyses_data = self.extract_analysis_data(analysis_tokens)
-        return date, analyses_data
-
-    def clean_text(self, text: str) -> str:
-        text = text.strip(' .')
-        text = text.lower()
-        return text
-
-    def separate_date_and_analyses(self, text) -> (datetime.date, str):
-        """Extract date from the start of the analyses string."""
-        if text.startswith('- '):
-            text = text.lstrip('- ')
-        date_token, rest_of_the_string = text.split(' ', maxsplit=1)
-        return date_token, rest_of_the_string
-
-    def separate_analyses(self, text: str) -> list:
-        analyses_tokens = text.split(',')
-        analyses_tokens = [self.clean_text(a) for a in analyses_tokens]
-        return analyses_tokens
-
-    def extract_analysis_data(self, analysis_tokens: list) -> dict:
-        analysis_data = []
-        for token in analysis_tokens:
-            analyte, content = token.split(' ', maxsplit=1)
-            data = self.extract_data(content)
-            data['name'] = analyte
-            analysis_data.append(data)
-        return analysis_data
-
-    def extract_data(self, text: str) -> dict: # TODO: ugly function!
-        tokens = text.split()
-        content = dict(EMPTY_ANALYSIS_DATA)
-        # control the first token to find value or rating
-        if self.is_value(tokens[0]):
-            content['value'] = float(tokens[0])
-        else:
-            content['rate'] = tokens[0] # TODO: check is a real rate
-        # control the second token to find units
-        if len(tokens) > 1:
-            if self.is_range(tokens[1]):
-                low, high = self.process_range(tokens[1])
-                content['lower_limit'] = low
-                content['upper_limit'] = high
-            else:
-                content['unit'] = tokens[1]
-        # control the third token to find range
-        if len(tokens) > 2:
-            if self.is_range(tokens[2]):
-                low, high = self.process_range(tokens[2])
-                content['lower_limit'] = low
-                content['upper_limit'] = high
-        return content
-
-    def is_value(self, token: str):
-        try:
-            value = float(token)
-        except ValueError:
-            return False
-        return True
-
-    def is_range(self, token: str) -> bool:
-        # if it starts and ends with ( ) it's a range.
-        return token.startswith('(') and token.endswith(')')
-
-    def process_range(self, text: str):
-        text = text.strip('()')
-        if text.startswith('<'):
-            low = None
-            high = float(text.strip('<'))
-        elif text.startswith('>'):
-            low = float(text.strip('>'))
-            high = None
-        else:
-            low, high = text.split('-')
-            low = float(low)
-            high = float(high)
-        return low, high
+        """Return the date token and a dict for each analysis."""
+        date, analyses = self.parse(text)
+        return date, [analysis.as_dict() for analysis in analyses]
+
+    def iter_text_to_analysis(self, lines):
+        """Lazily yield text_to_analysis() of every non blank line.
+
+        lines: a block of text with a report per line or an iterable of
+        report lines (e.g. an open file).
+        """
+        for date, analyses in self.iter_parse(lines):
+            yield date, [analysis.as_dict() for analysis in analyses]
+
+    def iter_parse(self, lines):
+        """Lazily yield parse() of every non blank line."""
+        if isinstance(lines, str):
+            lines = lines.splitlines()
+        for line in lines:
+            if line.strip(' .\r\n\t'):
+                yield self.parse(line)
+
+    @profile_hook('TextToAnalysisTranslator.parse', passive=True)
+    def parse(self, text: str) -> tuple:
+        """Return the date token and an AnalysisData for each analysis."""
+        text = text.strip(' .').lower()
+        header = _HEADER_RE.match(text)
+        if header is None:
+            raise ValueError(f"missing date in {text!r}")
+        start = header.end()
+        tokens = _ANALYSIS_RE.findall(text, start)
+        # every analysis consumes exactly one comma: a missing one means
+        # that something was skipped
+        if len(tokens) != text.count(',', start) + 1:
+            raise ValueError(f"cannot read analyses in {text!r}")
+        analyses = []
+        for name, first, second, third in tokens:
+            lower_limit = upper_limit = unit = None
+            first = first.rstrip('.')
+            try:
+                value, rate = float(first), None
+            except ValueError:
+                value, rate = None, first # TODO: check is a real rate
+            # a trailing lone '.' is a token of its own: skip it
+            second = second.rstrip('.')
+            third = third.rstrip('.')
+            if second:
+                # if it starts and ends with ( ) it's a range.
+                if second[0] == '(' and second[-1] == ')':
+                    lower_limit, upper_limit = _process_range(second)
+                else:
+                    unit = second
+            if third:
+                if third[0] == '(' and third[-1] == ')':
+                    lower_limit, upper_limit = _process_range(third)
+            analyses.append(AnalysisData(value, rate, lower_limit, upper_limit,
+                                         name, unit))
+        return header.group(1), analyses
+
+
+class PrefixIndex:
+    """Sorted array of (key, value) pairs searchable by key prefix."""
+
+    def __init__(self, pairs):
+        pairs = sorted(pairs, key=lambda pair: pair[0])
+        self._keys = [key for key, value in pairs]
+        self._values = [value for key, value in pairs]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def exact(self, key: str) -> set:
+        """Values whose key is exactly key."""
+        found = set()
+        i = bisect_left(self._keys, key)
+        while i < len(self._keys) and self._keys[i] == key:
+            found.add(self._values[i])
+            i += 1
+        return found
+
+    def search(self, prefix: str) -> set:
+        """Values whose key starts with prefix."""
+        found = set()
+        i = bisect_left(self._keys, prefix)
+        while i < len(self._keys) and self._keys[i].startswith(prefix):
+            found.add(self._values[i])
+            i += 1
+        return found
 
 
 class ItalianPeriodDate:
+    """A day, a month or a year: 28/11/1971, 11/1971 or 1971.
+
+    Instances are immutable and hashable; fromstring and fromkey cache them,
+    so the repeated dates of a result set share one instance.
+    """
 
     MONTH_DURATION = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
     LIMIT_FOR_2K = 70 # 72 --> 1972; 55 --> 2055
+    PRECISIONS = 'ymd'
+    CACHE_SIZE = 4096
+
+    __slots__ = ('_year', '_month', '_day', '_key')
 
     def __init__(self, year: int, month: int = None, day: int = None):
         if year < 0: raise ValueError("year must be positive.")
-        digits = len(str(year))
-        if digits != 2 and digits != 4:
+        if not (10 <= year <= 99 or 1000 <= year <= 9999):
             raise ValueError("year must be 2 or 4 digits.")
         if year < 100:
             if year < self.LIMIT_FOR_2K:
                 year = 2000 + year
             else:
                 year = 1900 + year
-        self._year = year
-        self._month = None
-        self._day = None
         if month is None and bool(day) is True:
             raise ValueError("Cannot set day without month.")
         if month:
             if month < 1 or month > 12:
                 raise ValueError("month number out of range.")
-            self._month = month
             if day:
-                if day < 1 or day > self.MONTH_DURATION[self._month - 1]:
+                if day < 1 or day > self.MONTH_DURATION[month - 1]:
                     raise ValueError("day number out of range.")
-                self._day = day
+            else:
+                day = None
+        else:
+            month = day = None
+        set_attribute = super().__setattr__
+        set_attribute('_year', year)
+        set_attribute('_month', month)
+        set_attribute('_day', day)
+        set_attribute('_key', f"{year:04d}{month or 0:02d}{day or 0:02d}"
+                              f"{'d' if day else 'm' if month else 'y'}")
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ItalianPeriodDate is immutable.")
+
+    def __reduce__(self):
+        return self.__class__, (self._year, self._month, self._day)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __hash__(self):
+        return hash(self._key)
 
     @classmethod
     def fromstring(cls, time: str):
         """time: d/m/yy or d/m/yyyy or m/yy or m/yyyy or yyyy."""
-        day = None
-        month = None
-        tokens = time.split('/')
-        tokens.reverse()
-        tokens_number = len(tokens)
-        if tokens_number >= 1:
-            year = int(tokens[0])
-        if tokens_number > 1:
-            month = int(tokens[1])
-        if tokens_number > 2:
-            day = int(tokens[2])
-        return cls(year, month, day)
+        return _period_fromstring(cls, time)
+
+    @classmethod
+    def fromkey(cls, key: str):
+        """key: the sortable 'yyyymmddp' string made by the key property."""
+        return _period_fromkey(cls, key)
+
+    @property
+    def key(self) -> str:
+        """Fixed width 'yyyymmddp' string that sorts like the dates.
+
+        Unknown month and day are 00 and p is the precision: y, m or d, so
+        1971 < 11/1971 < 28/11/1971 < 12/1971 < 1972.
+        """
+        return self._key
+
+    def key_range(self) -> tuple:
+        """(low, high): low <= key < high for the keys of the periods in self.
+
+        11/1971 -> ('197111', '197111~') holds 11/1971 and all its days.
+        """
+        low = self._key[:8 if self._day else 6 if self._month else 4]
+        return low, low + '~'
+
+    def enclosing_keys(self) -> list:
+        """Keys of the periods containing self: 28/11/1971 -> 1971, 11/1971."""
+        keys = []
+        if self._month:
+            keys.append(f"{self._year:04d}0000y")
+            if self._day:
+                keys.append(f"{self._year:04d}{self._month:02d}00m")
+        return keys
 
     def __str__(self):
         if self._day:
@@ -159,9 +251,9 @@ class ItalianPeriodDate:
         return f"{day}{month}{self._year}"
 
     def __eq__(self, other: 'ItalianPeriodDate') -> bool:
-        return self._day == other._day \
-           and self._month == other._month \
-           and self._year == other._year
+        if not isinstance(other, ItalianPeriodDate):
+            return NotImplemented
+        return self._key == other._key
 
     def __ne__(self, other: 'ItalianPeriodDate') -> bool:
         return not self == other
@@ -259,7 +351,35 @@ class ItalianPeriodDate:
                 return False
 
 
+@lru_cache(maxsize=ItalianPeriodDate.CACHE_SIZE)
+def _period_fromstring(cls, time: str) -> ItalianPeriodDate:
+    day = None
+    month = None
+    tokens = time.split('/')
+    tokens.reverse()
+    tokens_number = len(tokens)
+    if tokens_number >= 1:
+        year = int(tokens[0])
+    if tokens_number > 1:
+        month = int(tokens[1])
+    if tokens_number > 2:
+        day = int(tokens[2])
+    return cls(year, month, day)
+
+
+@lru_cache(maxsize=ItalianPeriodDate.CACHE_SIZE)
+def _period_fromkey(cls, key: str) -> ItalianPeriodDate:
+    if len(key) != 9 or key[8] not in cls.PRECISIONS:
+        raise ValueError(f"invalid ItalianPeriodDate key {key!r}.")
+    return cls(int(key[:4]), int(key[4:6]) or None, int(key[6:8]) or None)
+
+
 class ItalianPeriodDateField(CharField):
+    """Store an ItalianPeriodDate as its sortable key ('yyyymmddp').
+
+    ORDER BY and range comparisons on the column follow the dates; values
+    in the old 'd/m/yyyy' format are still read.
+    """
 
     def __init__(self, *args, **kwargs):
         kwargs['max_length'] = 10
@@ -270,12 +390,13 @@ class ItalianPeriodDateField(CharField):
         del kwargs["max_length"]
         return name, path, args, kwargs
 
+    @profile_hook('ItalianPeriodDateField.from_db_value', passive=True)
     def from_db_value(self, value, expression, connection):
         # super().from_db_value(value, expression, connection)
         if value is None:
             return value
         try:
-            return ItalianPeriodDate.fromstring(value)
+            return self.parse(value)
         except ValueError:
             raise ValidationError('valore non valido')
 
@@ -285,42 +406,270 @@ class ItalianPeriodDateField(CharField):
         if value is None:
             return value
         try:
-            return ItalianPeriodDate.fromstring(value)
+            return self.parse(value)
         except ValueError:
             raise ValueError('valore non valido')
 
     def get_prep_value(self, value):
-        return str(value)
+        if value is None:
+            return value
+        return self.to_python(value).key
+
+    @staticmethod
+    def parse(value: str) -> ItalianPeriodDate:
+        if '/' in value or len(value) != 9:
+            return ItalianPeriodDate.fromstring(value)
+        return ItalianPeriodDate.fromkey(value)
+
+
+_LOOKUP_PLACEHOLDER_RE = re.compile(r'\{lhs\}|%s')
+
+
+class PeriodLookup(Lookup):
+    """Base of the ItalianPeriodDateField lookups comparing periods.
+
+    They compile to range predicates on the sortable key, following the
+    semantics of the ItalianPeriodDate operators: a period is neither
+    before nor after a period that contains it or that it contains.
+    """
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        period = self.lhs.output_field.to_python(self.rhs)
+        sql, rhs_params = self.period_sql(period)
+        # keep the parameters in the order of their placeholders
+        rhs_params = iter(rhs_params)
+        params = []
+        for token in _LOOKUP_PLACEHOLDER_RE.findall(sql):
+            if token == '{lhs}':
+                params.extend(lhs_params)
+            else:
+                params.append(next(rhs_params))
+        return sql.replace('{lhs}', lhs), params
+
+    def period_sql(self, period: ItalianPeriodDate) -> tuple:
+        """Return the SQL with {lhs} placeholders and its parameters."""
+        raise NotImplementedError
+
+    @staticmethod
+    def not_enclosing(period: ItalianPeriodDate) -> tuple:
+        keys = period.enclosing_keys()
+        if not keys:
+            return '', []
+        placeholders = ', '.join(['%s'] * len(keys))
+        return f' AND {{lhs}} NOT IN ({placeholders})', keys
+
+
+@ItalianPeriodDateField.register_lookup
+class PeriodWithin(PeriodLookup):
+    """date__within='2018': dates in 2018, including 2018 itself."""
+    lookup_name = 'within'
+
+    def period_sql(self, period):
+        return '({lhs} >= %s AND {lhs} < %s)', list(period.key_range())
+
+
+@ItalianPeriodDateField.register_lookup
+class PeriodCompatible(PeriodLookup):
+    """date__compatible='11/2018': dates d with d @ 11/2018."""
+    lookup_name = 'compatible'
+
+    def period_sql(self, period):
+        keys = period.enclosing_keys()
+        sql = '({lhs} >= %s AND {lhs} < %s'
+        if keys:
+            sql += ' OR {lhs} IN (' + ', '.join(['%s'] * len(keys)) + ')'
+        return sql + ')', list(period.key_range()) + keys
+
+
+@ItalianPeriodDateField.register_lookup
+class PeriodLessThan(PeriodLookup):
+    lookup_name = 'lt'
+
+    def period_sql(self, period):
+        enclosing_sql, keys = self.not_enclosing(period)
+        return f'({{lhs}} < %s{enclosing_sql})', \
+            [period.key_range()[0]] + keys
+
+
+@ItalianPeriodDateField.register_lookup
+class PeriodLessThanOrEqual(PeriodLookup):
+    lookup_name = 'lte'
+
+    def period_sql(self, period):
+        enclosing_sql, keys = self.not_enclosing(period)
+        return f'({{lhs}} = %s OR {{lhs}} < %s{enclosing_sql})', \
+            [period.key, period.key_range()[0]] + keys
+
+
+@ItalianPeriodDateField.register_lookup
+class PeriodGreaterThan(PeriodLookup):
+    lookup_name = 'gt'
+
+    def period_sql(self, period):
+        return '{lhs} >= %s', [period.key_range()[1]]
+
+
+@ItalianPeriodDateField.register_lookup
+class PeriodGreaterThanOrEqual(PeriodLookup):
+    lookup_name = 'gte'
+
+    def period_sql(self, period):
+        return '({lhs} = %s OR {lhs} >= %s)', \
+            [period.key, period.key_range()[1]]
+
+
+def prefix_range(field: str, prefix: str) -> Q:
+    """field starts with prefix, as a range that can use an index.
+
+    SQLite's LIKE (used by startswith) never uses the indexes.
+    """
+    return Q(**{field + '__gte': prefix, field + '__lt': prefix + '\U0010ffff'})
+
+
+def encode_cursor(values: tuple) -> str:
+    """Opaque URL-safe cursor of the ordering values of a keyset page."""
+    data = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def decode_cursor(cursor: str, types: tuple):
+    """Values of encode_cursor(), None when cursor is empty or invalid.
+
+    types are the types of the values: a cursor of other values, crafted
+    or stale, is invalid too.
+    """
+    if not cursor:
+        return None
+    try:
+        values = tuple(json.loads(base64.urlsafe_b64decode(cursor.encode())))
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if len(values) != len(types) or not all(
+            type(value) is value_type
+            for value, value_type in zip(values, types)):
+        return None
+    return values
+
+
+def make_pdf_styles() -> StyleSheet1:
+    """The paragraph styles of the documents, see PDF_STYLES."""
+    styles = StyleSheet1()
+    styles.add(ParagraphStyle(name='normal', fontName='Helvetica',
+                              fontSize=12))
+    styles.add(ParagraphStyle(name='label', parent=styles['normal'],
+                              fontName='Helvetica-Bold', leading=20))
+    styles.add(ParagraphStyle(name='center_label', parent=styles['label'],
+                              alignment=TA_CENTER))
+    styles.add(ParagraphStyle(name='notes', parent=styles['normal'],
+                              fontSize=8))
+    styles.add(ParagraphStyle(name='code', fontName='Courier-Bold',
+                              fontSize=30, leading=36))
+    styles.add(ParagraphStyle(name='exemption', parent=styles['label'],
+                              fontSize=14, alignment=TA_CENTER, leading=20))
+    return styles
+
+
+# built once, shared by every document
+PDF_STYLES = make_pdf_styles()
+
+
+class StaticParagraph(Paragraph):
+    """Paragraph that breaks its lines once per frame width.
+
+    The line breaks are shared by its copies, so the boilerplate of a
+    PDFFragment is neither parsed nor broken again by the next documents.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._line_breaks = {}
+
+    def breakLines(self, width):
+        key = tuple(width) if isinstance(width, list) else width
+        lines = self._line_breaks.get(key)
+        if lines is None:
+            lines = self._line_breaks[key] = super().breakLines(width)
+        return lines
+
+
+class PDFFragment:
+    """Static flowables built once and reused by every document.
+
+    The flowables returned by factory are built on first use and every
+    story gets shallow copies of them (the layout state of a flowable is
+    set on the copy). With StaticParagraph neither the markup nor the line
+    breaks are computed again. Use it as a decorator:
+
+        @PDFFragment
+        def header():
+            return [StaticParagraph("Regione Lombardia", PDF_STYLES['label'])]
+
+        story = header.flowables() + [...]
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._flowables = None
+
+    def flowables(self) -> list:
+        flowables = self._flowables
+        if flowables is None:
+            flowables = self._flowables = tuple(self.factory())
+        return [copy(flowable) for flowable in flowables]
+
+    def clear(self) -> None:
+        """Drop the built flowables, e.g. after changing PDF_STYLES."""
+        self._flowables = None
 
 
 class PDFGeneratorView(View):
+    """Base view of the PDF documents.
+
+    Subclasses give the data printed with get_pdf_data() and lay it out in
+    make_story(data), mixing PDFFragment copies for the static parts with
+    the dynamic flowables. The document is written to a temporary file and
+    streamed with FileResponse; make_pdf(data) returns it as bytes instead.
+    """
 
     DEFAULT_PDF_FILE_NAME = 'doc'
+    pdf_title = ''
+    page_size = A4
 
     def get(self, request, *args, **kwargs):
         return self.render_to_response()
 
     def render_to_response(self):
-        response = HttpResponse(content_type='application/pdf')
-        response = self.make_pdf(response)
-        response = self.make_pdf_file_name(response)
-        return response
-
-    def make_pdf(self, response: HttpResponse) -> HttpResponse:
-        document = self.make_document(response)
-        story = self.make_story()
-        document.build(story)
-        return response # TODO: add title of the pdf document
-
-    def make_pdf_file_name(self, response: HttpResponse) -> HttpResponse:
-        response['Content-Disposition'] = \
-            f'attachment; filename="prova{self.DEFAULT_PDF_FILE_NAME}.pdf"'
-
-    def make_document(self, response: HttpResponse) -> SimpleDocTemplate:
-        return SimpleDocTemplate(response, pageSize=A4)
-
-    def make_story(self) -> list:
-        normal = ParagraphStyle(name='normal', fontName='Helvetica', fontSize=12)
-        story = []
-        story.append(Paragraph("Ciao", normal))
-        return story
+        file = tempfile.TemporaryFile()
+        try:
+            self.write_pdf(file, self.get_pdf_data())
+        except BaseException:
+            file.close()
+            raise
+        file.seek(0)
+        return FileResponse(file, as_attachment=True,
+                            filename=self.make_pdf_file_name(),
+                            content_type='application/pdf')
+
+    def get_pdf_data(self) -> dict:
+        return {}
+
+    def make_pdf(self, data: dict) -> bytes:
+        buffer = io.BytesIO()
+        self.write_pdf(buffer, data)
+        return buffer.getvalue()
+
+    @profile_hook('PDFGeneratorView.write_pdf')
+    def write_pdf(self, file, data: dict) -> None:
+        self.make_document(file).build(self.make_story(data))
+
+    def make_pdf_file_name(self) -> str:
+        return f'{self.DEFAULT_PDF_FILE_NAME}.pdf'
+
+    def make_document(self, file) -> SimpleDocTemplate:
+        return SimpleDocTemplate(file, pagesize=self.page_size,
+                                 title=self.pdf_title)
+
+    def make_story(self, data: dict) -> list:
+        return [Paragraph("Ciao", PDF_STYLES['normal'])]
@@ -0,0 +1,128 @@
+"""Bring an existing database up to the models of this tree.
+
+patients/migrations is not a package (no __init__.py, and 0001-0020 are
+missing), so `manage.py migrate` leaves the patients tables of a database
+created by the old migrations as they are. upgrade() adds what the
+models have and the database lacks: tables, columns and Meta.indexes,
+then fills the derived data of the new columns and stores the period
+dates still in the old 'd/m/yyyy' format as keys. Every step looks at
+the schema or the data first, so running it again changes nothing.
+manage.py upgrade_db runs it.
+"""
+from django.apps import apps
+from django.db import connections, transaction
+
+from .managers import rating_expression
+from .search import TABLE as SEARCH_TABLE, PatientSearchIndex
+from .tools import ItalianPeriodDate
+
+# the tables with an ItalianPeriodDateField date
+PERIOD_DATE_TABLES = ('patients_analysis', 'patients_bmd')
+
+
+def upgrade(using: str = 'default') -> list:
+    """Upgrade the database using; return the descriptions of the steps
+    done."""
+    connection = connections[using]
+    done = []
+    with connection.schema_editor() as schema_editor:
+        for model in apps.get_app_config('patients').get_models():
+            done += sync_model(schema_editor, model)
+    if 'added column patients_analysis.computed_rating' in done:
+        done.append(rate_analyses(using))
+    converted, invalid = convert_period_dates(using)
+    if converted:
+        done.append(f'converted {converted} period dates to keys')
+    if invalid:
+        done.append(f'left {invalid} invalid period dates as they are')
+    done += sync_search_table(using)
+    return done
+
+
+def sync_model(schema_editor, model) -> list:
+    """Create the table, columns and indexes of model missing in the
+    database."""
+    connection = schema_editor.connection
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if table not in connection.introspection.table_names(cursor):
+            schema_editor.create_model(model)
+            return [f'created table {table}']
+        columns = {column.name for column in
+                   connection.introspection.get_table_description(
+                       cursor, table)}
+    done = []
+    for field in model._meta.local_fields:
+        if field.column not in columns:
+            schema_editor.add_field(model, field)
+            done.append(f'added column {table}.{field.column}')
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    for index in model._meta.indexes:
+        if index.name not in constraints:
+            schema_editor.add_index(model, index)
+            done.append(f'added index {index.name}')
+    return done
+
+
+def rate_analyses(using: str) -> str:
+    Analysis = apps.get_model('patients', 'Analysis')
+    rated = Analysis.objects.using(using).update(
+        computed_rating=rating_expression(Analysis._tolerance))
+    return f'rated {rated} analyses'
+
+
+def sync_search_table(using: str) -> list:
+    """Fill the patient search table when it misses patients."""
+    index = PatientSearchIndex(using)
+    if not index.available():
+        return []
+    index.create_table()
+    Patient = apps.get_model('patients', 'Patient')
+    with index.connection.cursor() as cursor:
+        cursor.execute(f'SELECT count(*) FROM {SEARCH_TABLE}')
+        indexed = cursor.fetchone()[0]
+    if indexed == Patient.objects.using(using).count():
+        return []
+    return [f'indexed {index.rebuild()} patients']
+
+
+def to_key(value: str) -> str:
+    """'d/m/yyyy', 'm/yyyy' or 'yyyy' to 'yyyymmddp'."""
+    return ItalianPeriodDate.fromstring(value).key
+
+
+def from_key(value: str) -> str:
+    """'yyyymmddp' to 'd/m/yyyy', 'm/yyyy' or 'yyyy'."""
+    return str(ItalianPeriodDate.fromkey(value))
+
+
+def is_key(value: str) -> bool:
+    return '/' not in value and len(value) == 9
+
+
+def convert_period_dates(using: str = 'default',
+                         backwards: bool = False) -> tuple:
+    """Store the period dates as keys, or back in the old format.
+
+    Return the number of dates converted and of the invalid ones, which
+    are left as they are.
+    """
+    converter = from_key if backwards else to_key
+    converted = invalid = 0
+    with transaction.atomic(using=using), \
+            connections[using].cursor() as cursor:
+        for table in PERIOD_DATE_TABLES:
+            cursor.execute(f'SELECT id, date FROM {table}')
+            rows = []
+            for pk, date in cursor.fetchall():
+                if date is None or is_key(date) == (not backwards):
+                    continue
+                try:
+                    rows.append((converter(date), pk))
+                except ValueError:
+                    invalid += 1
+            cursor.executemany(f'UPDATE {table} SET date = %s WHERE id = %s',
+                               rows)
+            converted += len(rows)
+    return converted, invalid
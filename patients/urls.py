@@ -11,14 +11,28 @@ urlpatterns = [
          name='home'),
     path('<int:pk>/', PatientDetailView.as_view(),
          name='patient_detail'),
+    path('<int:pk>/series/', PatientSeriesView.as_view(),
+         name='patient_series'),
     path('<int:pk>', PatientExemptionsView.as_view(),
          name='patient_exemptions_list'),
     path('rapid_add_exemption/', RapidAddExemptionView.as_view(),
          name='rapid_add_exemption'),
     path('list/', PatientsListView.as_view(),
          name='patients_list'),
+    path('search/', PatientSearchView.as_view(),
+         name='patient_search'),
     path('exemption_pdf/<int:pk>', PDFResponseView.as_view(),
          name='exemption_pdf'),
+    path('exemption_pdf/batch/', ExemptionBatchPDFView.as_view(),
+         name='exemption_pdf_batch'),
+    path('pdf_jobs/<uuid:pk>/', PDFJobStatusView.as_view(),
+         name='pdf_job'),
+    path('pdf_jobs/<uuid:pk>/download/', PDFJobDownloadView.as_view(),
+         name='pdf_job_download'),
+    path('pdf_jobs/<slug:kind>/', PDFJobCreateView.as_view(),
+         name='pdf_job_create'),
+    path('perf/', PerfStatsView.as_view(),
+         name='perf_stats'),
     path('test/', TestTextToAnalysisView.as_view(),
          name="test"),
     path('test_pdf/', TestPDFResponseView.as_view(),
@@ -1,43 +1,148 @@
-from django.http import FileResponse, HttpResponse
+import hashlib
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.http import FileResponse, Http404, HttpResponse, \
+    HttpResponseBadRequest, HttpResponseNotModified, JsonResponse
+from django.shortcuts import get_object_or_404
 from django.views import View
 from django.views.generic import TemplateView, ListView, DetailView, \
     FormView
+from django.views.generic.detail import SingleObjectMixin
+from django.db.models import Prefetch, Q
 from django.urls import reverse
-from reportlab.lib.enums import TA_CENTER
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import ParagraphStyle
-from reportlab.lib.units import cm
-from reportlab.platypus import SimpleDocTemplate, Spacer, Paragraph
+from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags
+from . import certificates
+from .databases import ReplicaReadMixin
 from .forms import *
+from .jobs import pdf_job_queue
+from .managers import AMBIGUOUS
+from .perf import load_snapshots, perf_stats, summarize
 from .models import *
-from .tools import PDFGeneratorView
+from .search import patient_search_index
+from .tools import PDFGeneratorView, decode_cursor, encode_cursor, \
+    prefix_range
 
 
 class HomeView(TemplateView):
     template_name = 'patients/home.html'
 
 
-class PatientsListView(ListView):
+class PatientsListView(ReplicaReadMixin, ListView):
+    """Patients by name, a page at a time, with keyset pagination.
+
+    ?q= searches a last name [first name] prefix or a fiscal code prefix;
+    ?after= is the cursor of the last patient of the previous page.
+    """
     model = Patient
     template_name = 'patients/patients_list.html'
+    context_object_name = 'patient_list'
+    ordering = ('last_name', 'first_name', 'pk')
+    page_size = 50
+
+    def get_queryset(self):
+        queryset = self.search(super().get_queryset(), self.get_search())
+        after = decode_cursor(self.request.GET.get('after', ''),
+                              (str, str, int))
+        if after is not None:
+            last_name, first_name, pk = after
+            # the redundant last_name__gte lets the index seek the cursor
+            queryset = queryset.filter(last_name__gte=last_name).filter(
+                Q(last_name__gt=last_name) |
+                Q(last_name=last_name, first_name__gt=first_name) |
+                Q(last_name=last_name, first_name=first_name, pk__gt=pk))
+        return queryset
+
+    def get_search(self) -> str:
+        return self.request.GET.get('q', '').strip()
+
+    def search(self, queryset, text: str):
+        if not text:
+            return queryset
+        words = text.lower().split()
+        if len(words) == 1 and any(c.isdigit() for c in text):
+            return queryset.filter(prefix_range('fiscal_code', text.upper()))
+        queryset = queryset.filter(prefix_range('last_name', words[0]))
+        if len(words) > 1:
+            queryset = queryset.filter(
+                prefix_range('first_name', ' '.join(words[1:])))
+        return queryset
+
+    def get_context_data(self, **kwargs):
+        page = list(self.object_list[:self.page_size + 1])
+        next_cursor = None
+        if len(page) > self.page_size:
+            page = page[:self.page_size]
+            last = page[-1]
+            next_cursor = encode_cursor(
+                (last.last_name, last.first_name, last.pk))
+        context = super().get_context_data(object_list=page, **kwargs)
+        context['next_cursor'] = next_cursor
+        context['q'] = self.get_search()
+        return context
 
 
 class PatientDetailView(DetailView):
+    """The patient with exemptions, analyses and BMD, in a fixed number of
+    queries whatever their number."""
     model = Patient
     template_name = 'patients/patient_detail.html'
 
+    def get_queryset(self):
+        return super().get_queryset().prefetch_related(
+            Prefetch('exemption_set',
+                     queryset=Exemption.objects.select_related('exemption')
+                     .order_by('-signature_date', '-pk')),
+            Prefetch('analysis_set',
+                     queryset=Analysis.objects.select_related('name')
+                     .order_by('-date', 'name__short_name')),
+            Prefetch('bmd_set', queryset=BMD.objects.order_by('-date')),
+        )
+
     def get_context_data(self, **kwargs):
         """Pass the patient to the template and also other data."""
         context = super().get_context_data(**kwargs)
-        context['exemptions'] = Exemption.objects.filter(
-                patient_id=self.object.pk)
-        # make an unbound RapidExemptionForm form
-        context['exemption_form'] = RapidExemptionForm()
+        context['exemptions'] = self.object.exemption_set.all()
+        context['analyses'] = self.object.analysis_set.all()
+        context['bmds'] = self.object.bmd_set.all()
+        # make an unbound RapidExemptionForm form for this patient
+        context['exemption_form'] = RapidExemptionForm(patient=self.object)
         # context['plans'] =
         # context['visits'] =
         return context
 
 
+class PatientSeriesView(View):
+    """JSON time series of the analyses of a patient, for the charts.
+
+    ?analyte=TSH&analyte=FT4 selects the analytes (default: all).
+    """
+
+    def get(self, request, *args, **kwargs):
+        patient = get_object_or_404(Patient, pk=kwargs['pk'])
+        analytes = request.GET.getlist('analyte') or None
+        series = Analysis.objects.series(patient, analytes=analytes)
+        return JsonResponse({'patient': patient.pk, 'series': series})
+
+
+class PatientSearchView(View):
+    """JSON autocomplete of the patients matching ?q= ('ross mar 1971')."""
+
+    def get(self, request, *args, **kwargs):
+        patients = patient_search_index.search(request.GET.get('q', ''))
+        return JsonResponse({'results': [
+            {'id': patient.pk, 'label': str(patient),
+             'url': reverse('patients:patient_detail', args=[patient.pk])}
+            for patient in patients]})
+
+
 class PatientExemptionsView(ListView):
     """Return the exemptions linked to a patient."""
     model = Exemption
@@ -63,96 +168,147 @@ class RapidAddExemptionView(FormView):
         return super().form_valid(form)
 
 
-class PDFResponseView(DetailView):
-
-    model = Exemption
-
-    def render_to_response(self, context, **response_kwargs): # TODO: move body function in tools
-        return self.make_pdf()
-
-    def make_pdf(self):
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename="prova{}.pdf'.format(self.object.pk)
-
-        doc = SimpleDocTemplate(response, pageSize=A4)
-        name = self.object.name.upper()
-        birth_place = self.object.birth_place.capitalize()
-        birth_date = self.object.birth_date.strftime("%d/%m/%Y")
-        exemption_name = self.object.exemption.name.title()
-        exemption_code = self.object.exemption.code
-        place = self.object.signature_place.municipality.capitalize()
-        date = self.object.signature_date.strftime("%d/%m/%Y")
-
-        normal = ParagraphStyle(name='normal', fontName='Helvetica', fontSize=12)
-        label = ParagraphStyle(name='label', parent=normal, fontName='Helvetica-Bold',
-                               leading=20)
-        center_label = ParagraphStyle(name='center_label', parent=label,
-                                      alignment=TA_CENTER)
-        notes = ParagraphStyle(name='notes', parent=normal, fontSize=8)
-        code = ParagraphStyle(name='code', fontName='Courier-Bold', fontSize=30,
-                              leading=36)
-        exemption = ParagraphStyle(name='exemption', parent=label, fontSize=14,
-                                   alignment=TA_CENTER, leading=20)
-
-        story = []
-        story.append(Paragraph("Regione Lombardia", center_label))
-
-        story.append(Spacer(1, 3 * cm))
-
-        story.append(Paragraph("CERTIFICAZIONE", center_label))
-        story.append(Paragraph('ai sensi dell’art.4, '
-                               'comma 1 del Decreto Ministero Sanità 28 maggio 1999, '
-                               'n. 329 “Regolamento recante norme di individuazione '
-                               'delle malattie croniche e invalidanti ai sensi dell’'
-                               'articolo 5, comma 1, lettera a) del decreto legislativo'
-                               ' 29 aprile 1998, n. 124”, come modificato dal Decreto '
-                               'Ministero Sanità 21 maggio 2001 n. 296 “Regolamento di '
-                               'aggiornamento del decreto ministeriale 28 maggio 1999, '
-                               'n 329...”', notes))
+class PDFResponseView(SingleObjectMixin, PDFGeneratorView):
+    """Exemption certificate PDF.
 
-        story.append(Spacer(1, 1 * cm))
+    The rendered PDFs are cached by a hash of the data printed on them,
+    which is also their ETag, so unchanged certificates are neither
+    rendered again nor, with If-None-Match, downloaded again.
+    """
 
-        story.append(Paragraph(f'Si certifica che la/il Sig.ra/re <i>{name}</i>', label))
-        story.append(Paragraph(f"nata/o a <i>{birth_place}</i>", label))
-        story.append(Paragraph(f"in data <i>{birth_date}</i>", label))
-
-        story.append(Spacer(1, 0.5 * cm))
-
-        story.append(Paragraph("È affetta/o dalla seguente patologia", center_label))
-        story.append(Paragraph("(descrivere la patologia come riportato nell’elenco di "
-                               "cui all’Allegato 1-II parte del D.M. 329/99 come "
-                               "modificato dal D.M. 296/2001).", notes))
+    model = Exemption
+    DEFAULT_PDF_FILE_NAME = 'prova'
+    pdf_title = certificates.TITLE
+    # change it when the layout of the certificate changes
+    PDF_VERSION = 2
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        return self.render_to_response()
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('exemption',
+                                                     'signature_place')
+
+    def render_to_response(self):
+        data = self.get_pdf_data()
+        etag = '"{}"'.format(self.get_pdf_hash(data))
+        if etag in parse_etags(self.request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            cache = caches[getattr(settings, 'PDF_CACHE', 'default')]
+            pdf = cache.get(etag)
+            if pdf is None:
+                pdf = self.make_pdf(data)
+                cache.set(etag, pdf, None)
+            response = HttpResponse(pdf, content_type='application/pdf')
+            response['Content-Disposition'] = \
+                f'attachment; filename="{self.make_pdf_file_name()}"'
+        response['ETag'] = etag
+        return response
+
+    def get_pdf_data(self) -> dict:
+        """The data printed on the certificate."""
+        return certificates.exemption_data(self.object)
+
+    def get_pdf_hash(self, data: dict) -> str:
+        content = json.dumps([self.PDF_VERSION, data], sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def make_pdf_file_name(self) -> str:
+        return f'{self.DEFAULT_PDF_FILE_NAME}{self.object.pk}.pdf'
+
+    def make_story(self, data: dict) -> list:
+        return certificates.exemption_story(data)
+
+
+class ExemptionBatchPDFView(View):
+    """The certificates of the exemptions matching the filter of
+    ExemptionBatchForm, one per page of a single PDF.
+
+    e.g. ?date_from=2019-03-01&date_to=2019-03-01&place=1. The document is
+    written to a temporary file and streamed from there.
+    """
+
+    def get(self, request, *args, **kwargs):
+        form = ExemptionBatchForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        file = tempfile.TemporaryFile()
+        try:
+            if not certificates.write_exemptions_pdf(form.exemptions(),
+                                                     file):
+                raise Http404('No exemption matches the filter.')
+        except BaseException:
+            file.close()
+            raise
+        file.seek(0)
+        return FileResponse(file, as_attachment=True,
+                            filename='esenzioni.pdf',
+                            content_type='application/pdf')
+
+
+class PDFJobCreateView(View):
+    """POST the form data of a kind of PDF job to queue it.
+
+    Answer 202 with the status of the new job (see PDFJobStatusView), 400
+    with the errors of invalid data.
+    """
 
-        story.append(Paragraph(f'<i>{exemption_name}</i>', exemption))
+    def post(self, request, *args, **kwargs):
+        if kwargs['kind'] not in pdf_job_queue.renderers:
+            raise Http404('Unknown PDF job.')
+        try:
+            job = pdf_job_queue.enqueue(kwargs['kind'], request.POST.dict())
+        except ValidationError as error:
+            return JsonResponse({'errors': error.message_dict}, status=400)
+        response = JsonResponse(pdf_job_status(job), status=202)
+        response['Location'] = reverse('patients:pdf_job', args=[job.pk])
+        return response
 
-        story.append(Paragraph("(N.B.: in caso di IPERTENSIONE ARTERIOSA specificare "
-                               "CON DANNO D’ORGANO quando presente, in riferimento alle"
-                               " Linee Guida dell’O.M.S)", notes))
 
-        story.append(Spacer(1, 0.5 * cm))
+class PDFJobStatusView(View):
+    """JSON status of a PDF job, with the download_url once done."""
 
-        story.append(Paragraph("Contraddistinta dal Codice", center_label))
-        story.append(Paragraph("(riportare il Codice di cui all’Allegato 1-II parte del"
-                               " D.M. 329/99 come modificato dal D.M. \
-        296/2001)", notes))
+    def get(self, request, *args, **kwargs):
+        job = get_object_or_404(PDFJob, pk=kwargs['pk'])
+        return JsonResponse(pdf_job_status(job))
 
-        story.append(Spacer(1, 0.2 * cm))
 
-        story.append(Paragraph(f"{exemption_code}", code))
-        story.append(Paragraph("(Cod. progressivo) (Cod. I.C.D.9-C.M.)", notes))
+class PDFJobDownloadView(View):
 
-        story.append(Spacer(1, 1.5 * cm))
+    def get(self, request, *args, **kwargs):
+        job = get_object_or_404(PDFJob, pk=kwargs['pk'],
+                                status=PDFJob.DONE)
+        return FileResponse(job.file.open('rb'), as_attachment=True,
+                            filename=f'{job.kind}.pdf',
+                            content_type='application/pdf')
 
-        story.append(Paragraph(f"{place}, {date}", label))
 
-        story.append(Spacer(1, 1.5 * cm))
+def pdf_job_status(job) -> dict:
+    status = {'id': str(job.pk), 'kind': job.kind, 'status': job.status,
+              'pages': job.pages, 'error': job.error,
+              'status_url': reverse('patients:pdf_job', args=[job.pk])}
+    if job.status == PDFJob.DONE:
+        status['download_url'] = reverse('patients:pdf_job_download',
+                                         args=[job.pk])
+    return status
 
-        story.append(Paragraph("Timbro e firma del Medico", label))
 
-        doc.build(story)
+@method_decorator(staff_member_required, name='dispatch')
+class PerfStatsView(View):
+    """JSON percentiles of the request timings of this process, by URL
+    name; with ?all=1 those of every process (see patients.perf)."""
 
-        return response # TODO: add title of the pdf document
-                        # TODO: rewrite better this function
+    def get(self, request, *args, **kwargs):
+        directory = getattr(settings, 'PERF_STATS_DIR', None)
+        if request.GET.get('all') and directory:
+            perf_stats.snapshot(directory)
+            processes, samples = load_snapshots(directory)
+            return JsonResponse({'processes': processes,
+                                 'url_names': summarize(samples)})
+        return JsonResponse({'pid': os.getpid(),
+                             'url_names': perf_stats.summary()})
 
 
 class TestPDFResponseView(PDFGeneratorView):
@@ -164,7 +320,7 @@ class AnalysisView(ListView):
     template_name = "patients/analysis_list.html"
 
 
-class TestTextToAnalysisView(ListView, FormView): # TODO: check errors in text_to_analysis
+class TestTextToAnalysisView(ListView, FormView):
     model = Analysis
     form_class = TextToAnalysisForm
     success_url = '/patients/test'
@@ -178,12 +334,34 @@ class TestTextToAnalysisView(ListView, FormView): # TODO: check errors in text_t
         context['patient'] = Patient.objects.get(last_name__startswith='po')
         return context
 
+    def form_invalid(self, form):
+        self.object_list = self.get_queryset()
+        return super().form_invalid(form)
+
     def form_valid(self, form):
-        Analysis.objects.text_to_analysis(form.cleaned_data['text'],
-            Patient.objects.get(id=int(form.cleaned_data['patient'])))
+        try:
+            _, diagnostics = Analysis.objects.text_to_analysis(
+                form.cleaned_data['text'],
+                Patient.objects.get(id=int(form.cleaned_data['patient'])))
+        except ValueError as error:
+            form.add_error('text', str(error))
+            return self.form_invalid(form)
+        for diagnostic in diagnostics:
+            if diagnostic['status'] != 'created':
+                messages.warning(self.request, diagnostic_message(diagnostic))
         return super().form_valid(form)
 
 
+def diagnostic_message(diagnostic: dict) -> str:
+    """Why an analyte of text_to_analysis was not saved."""
+    analyte = f"{diagnostic['date']} {diagnostic['analyte']}"
+    if diagnostic['status'] == AMBIGUOUS:
+        candidates = ', '.join(name.short_name
+                               for name in diagnostic['candidates'])
+        return f'{analyte}: analita ambiguo ({candidates}), non salvato'
+    return f'{analyte}: analita sconosciuto, non salvato'
+
+
 class TestTextToAnalysisTranslatorView(View):
 
     def post(self, request, *args, **kwargs):